@@ -0,0 +1,7 @@
+"""
+Benchmarks for sunpy-soar, run with `asv <https://asv.readthedocs.io/>`__.
+
+The benchmarks do not contact the SOAR, they use synthetic responses built by
+``benchmarks.fixtures``, which are either returned directly by a stand-in
+session or sent over HTTP by a local server.
+"""
@@ -0,0 +1,38 @@
+"""
+Benchmarks for queuing the files of search results for download.
+"""
+
+import tempfile
+
+from sunpy_soar.client import SOARClient
+
+from .fixtures import make_results_table
+
+
+class _NullDownloader:
+    # Stands in for a parfive.Downloader, without downloading anything
+    def enqueue_file(self, url, **kwargs):
+        pass
+
+
+class FetchQueue:
+    """
+    Time generating the download URLs and paths of search results, none of
+    which have been downloaded before.
+    """
+
+    params = [1_000, 10_000, 100_000]
+    param_names = ["n_rows"]
+    timeout = 600
+
+    def setup(self, n_rows):
+        self.results = make_results_table(n_rows)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = f"{self.tmp_dir.name}/{{file}}"
+        self.client = SOARClient()
+
+    def teardown(self, n_rows):
+        self.tmp_dir.cleanup()
+
+    def time_fetch(self, n_rows):
+        self.client.fetch(self.results, path=self.path, downloader=_NullDownloader())
@@ -0,0 +1,138 @@
+"""
+Synthetic SOAR TAP responses used by the benchmarks.
+"""
+
+import datetime
+import http.server
+import io
+import json
+import threading
+
+import astropy.io.votable
+import astropy.table
+import requests
+
+from sunpy_soar.client import _TAP_ENDPOINT, SOARClient, _table_from_columns
+
+__all__ = ["TAP_METADATA", "LocalTAPServer", "make_results_table", "make_tap_json", "make_tap_response"]
+
+TAP_METADATA = [
+    {"name": "instrument", "datatype": "char", "arraysize": "*"},
+    {"name": "descriptor", "datatype": "char", "arraysize": "*"},
+    {"name": "level", "datatype": "char", "arraysize": "*"},
+    {"name": "begin_time", "datatype": "char", "arraysize": "*", "xtype": "timestamp"},
+    {"name": "end_time", "datatype": "char", "arraysize": "*", "xtype": "timestamp"},
+    {"name": "data_item_id", "datatype": "char", "arraysize": "*"},
+    {"name": "filesize", "datatype": "long"},
+    {"name": "filename", "datatype": "char", "arraysize": "*"},
+    {"name": "soop_name", "datatype": "char", "arraysize": "*"},
+]
+
+
+def make_tap_json(n_rows, instrument="MAG", descriptor="mag-rtn-normal"):
+    """
+    Build a TAP JSON response with ``n_rows`` rows of the SOAR data item table.
+
+    Rows are 10 seconds apart starting on 2021-01-01, and one in seven rows
+    has a SOOP name, the others have a null SOOP name.
+    """
+    start = datetime.datetime(2021, 1, 1)
+    data = []
+    for i in range(n_rows):
+        begin_time = (start + datetime.timedelta(seconds=10 * i)).strftime("%Y-%m-%dT%H:%M:%S.123")
+        data_item_id = f"solo_L2_{descriptor}_{i:07d}"
+        data.append(
+            [
+                instrument,
+                descriptor,
+                "L2",
+                begin_time,
+                begin_time,
+                data_item_id,
+                100_000 + i,
+                f"{data_item_id}_V01.cdf",
+                None if i % 7 else "none",
+            ]
+        )
+    return {"metadata": TAP_METADATA, "data": data}
+
+
+def make_tap_response(n_rows, response_format):
+    """
+    Build the body of a TAP response with ``n_rows`` rows in the given format.
+
+    The rows are the same as those of `make_tap_json`. VOTable responses use
+    the BINARY2 serialization.
+    """
+    response = make_tap_json(n_rows)
+    if response_format == "json":
+        return json.dumps(response).encode()
+    names = [column["name"] for column in response["metadata"]]
+    columns = list(zip(*response["data"], strict=True)) or [[] for _ in names]
+    table = astropy.table.Table(
+        [astropy.table.MaskedColumn(column, mask=[value is None for value in column]) for column in columns],
+        names=names,
+    )
+    if response_format == "csv":
+        body = io.StringIO()
+        table.write(body, format="ascii.csv")
+        return body.getvalue().encode()
+    body = io.BytesIO()
+    astropy.io.votable.from_table(table).to_xml(body, tabledata_format="binary2")
+    return body.getvalue()
+
+
+def make_results_table(n_rows):
+    """
+    Build the results table returned by ``SOARClient.search`` for the rows of
+    `make_tap_json`.
+    """
+    response = make_tap_json(n_rows)
+    columns = list(zip(*response["data"], strict=True)) or [[] for _ in response["metadata"]]
+    return SOARClient()._response_table(_table_from_columns(response["metadata"], columns))
+
+
+class LocalTAPServer:
+    """
+    An HTTP server on localhost standing in for the SOAR TAP service, which
+    returns the same body for every request.
+
+    Use as a context manager, and send queries with `session`.
+    """
+
+    def __init__(self, body, content_type="application/json"):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def session(self):
+        """
+        Create a session which sends requests for the SOAR to this server.
+        """
+        soar_url = _TAP_ENDPOINT.split("/soar-sl-tap", 1)[0]
+        local_url = self.url
+
+        class LocalSession(requests.Session):
+            def request(self, method, url, *args, **kwargs):
+                return super().request(method, url.replace(soar_url, local_url, 1), *args, **kwargs)
+
+        return LocalSession()
@@ -0,0 +1,16 @@
+"""
+Benchmarks for the time taken to import sunpy-soar.
+"""
+
+
+class Import:
+    """
+    Time importing sunpy-soar in a new interpreter.
+    """
+
+    def timeraw_import_sunpy_net(self):
+        # Most of the time is spent importing sunpy.net, which Fido needs to register the client
+        return "import sunpy.net.base_client"
+
+    def timeraw_import_sunpy_soar(self):
+        return "import sunpy_soar"
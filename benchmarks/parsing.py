@@ -0,0 +1,74 @@
+"""
+Benchmarks for turning SOAR TAP responses into result tables.
+"""
+
+import json
+import time
+
+import requests
+
+from sunpy_soar.client import SOARClient
+
+from .fixtures import make_tap_json, make_tap_response
+
+
+class _StaticSession:
+    # Stands in for a requests.Session, returning the same body for every query
+    def __init__(self, body):
+        self.body = body
+
+    def get(self, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = self.body
+        response._content_consumed = True
+        return response
+
+
+class TAPJSONParsing:
+    """
+    Time ``_do_search`` on a JSON response, excluding the network.
+    """
+
+    params = ([1_000, 10_000, 100_000, 1_000_000], [False, True])
+    param_names = ["n_rows", "stream"]
+    timeout = 600
+
+    def setup(self, n_rows, stream):
+        body = json.dumps(make_tap_json(n_rows)).encode()
+        self.client = SOARClient(session=_StaticSession(body), stream=stream)
+
+    def time_do_search(self, n_rows, stream):
+        self.client._do_search(["instrument='MAG'"])
+
+    def peakmem_do_search(self, n_rows, stream):
+        self.client._do_search(["instrument='MAG'"])
+
+    def track_rows_per_second(self, n_rows, stream):
+        start = time.perf_counter()
+        self.client._do_search(["instrument='MAG'"])
+        return n_rows / (time.perf_counter() - start)
+
+    track_rows_per_second.unit = "rows/s"
+
+
+class ResponseFormats:
+    """
+    Compare the size and the time taken to read each response format.
+    """
+
+    params = ([10_000, 100_000], ["json", "csv", "votable"])
+    param_names = ["n_rows", "response_format"]
+
+    def setup(self, n_rows, response_format):
+        self.body = make_tap_response(n_rows, response_format)
+        self.client = SOARClient(session=_StaticSession(self.body), response_format=response_format)
+
+    def time_do_search(self, n_rows, response_format):
+        self.client._do_search(["instrument='MAG'"])
+
+    def track_response_size(self, n_rows, response_format):
+        return len(self.body)
+
+    track_response_size.unit = "bytes"
@@ -0,0 +1,71 @@
+"""
+Benchmarks for turning sunpy attrs into the ADQL queries sent to the SOAR.
+"""
+
+import astropy.units as u
+import sunpy.net.attrs as a
+from sunpy.net.attr import and_, or_
+
+from sunpy_soar._attrs import walker
+from sunpy_soar.attrs import Distance, Product
+from sunpy_soar.client import SOARClient, _merge_queries, _query_plan
+
+_TIME = "begin_time>='2022-01-01 00:00:00' AND begin_time<='2022-01-02 00:00:00'"
+_QUERIES = {
+    "insitu": [_TIME, "instrument='MAG'", "level='L2'"],
+    "remote_sensing": [_TIME, "instrument='EUI'", "level='L2'", "Wavemin='17.4' AND Wavemax='17.4'"],
+    "distance": ["instrument='RPW'", "level='L2'", "DISTANCE(0.28,0.30)"],
+}
+
+
+class Walker:
+    """
+    Time converting a query for ``n_products`` data products into the query
+    items of each sub-query, and merging them.
+    """
+
+    params = [1, 10, 100]
+    param_names = ["n_products"]
+
+    def setup(self, n_products):
+        products = or_(*[Product(f"eui-fsi{i:03d}-image") for i in range(n_products)])
+        self.query = and_(a.Time("2022-01-01", "2022-01-02"), a.Level(2), products)
+        self.queries = walker.create(self.query)
+
+    def time_walker_create(self, n_products):
+        walker.create(self.query)
+
+    def time_merge_queries(self, n_products):
+        _merge_queries(self.queries)
+
+
+class DistanceWalker:
+    """
+    Time converting a distance query into query items.
+    """
+
+    def setup(self):
+        self.query = and_(a.Instrument("RPW"), a.Level(2), Distance(0.28 * u.AU, 0.30 * u.AU))
+
+    def time_walker_create(self):
+        walker.create(self.query)
+
+
+class ConstructPayload:
+    """
+    Time building the TAP request for a sub-query, with and without a cached
+    query plan.
+    """
+
+    params = list(_QUERIES)
+    param_names = ["query"]
+
+    def setup(self, query):
+        self.query = _QUERIES[query]
+
+    def time_construct_payload(self, query):
+        SOARClient._construct_payload(self.query)
+
+    def time_construct_payload_uncached(self, query):
+        _query_plan.cache_clear()
+        SOARClient._construct_payload(self.query)
@@ -0,0 +1,58 @@
+"""
+Benchmarks for searching a local stand-in for the SOAR and merging the results
+of sub-queries.
+"""
+
+import json
+
+import sunpy.net.attrs as a
+
+from sunpy_soar.client import SOARClient, _table_from_columns
+
+from .fixtures import LocalTAPServer, make_tap_json
+
+
+class SearchOverHTTP:
+    """
+    Time ``search`` end to end, with the responses sent over HTTP by a local
+    server.
+    """
+
+    params = [1_000, 10_000, 100_000, 1_000_000]
+    param_names = ["n_rows"]
+    timeout = 600
+
+    def setup(self, n_rows):
+        self.server = LocalTAPServer(json.dumps(make_tap_json(n_rows)).encode()).__enter__()
+        self.client = SOARClient(session=self.server.session())
+        self.query = (a.Time("2021-01-01", "2021-12-31"), a.Instrument("MAG"))
+
+    def teardown(self, n_rows):
+        self.server.__exit__(None, None, None)
+
+    def time_search(self, n_rows):
+        self.client.search(*self.query)
+
+    def peakmem_search(self, n_rows):
+        self.client.search(*self.query)
+
+
+class MergeResults:
+    """
+    Time merging the results of two sub-queries which overlap by half of
+    their rows.
+    """
+
+    params = [1_000, 10_000, 100_000, 1_000_000]
+    param_names = ["n_rows"]
+    timeout = 600
+
+    def setup(self, n_rows):
+        response = make_tap_json(n_rows)
+        table = _table_from_columns(response["metadata"], list(zip(*response["data"], strict=True)))
+        third = n_rows // 3
+        self.results = [table[: 2 * third], table[third:]]
+        self.client = SOARClient()
+
+    def time_merge_results(self, n_rows):
+        self.client._merge_results(self.results)
@@ -100,6 +100,9 @@ intersphinx_mapping = {
     "astropy": ("http://docs.astropy.org/en/stable/", None),
     "sunpy": ("https://docs.sunpy.org/en/stable/", None),
     "parfive": ("https://parfive.readthedocs.io/en/stable/", None),
+    "requests": ("https://requests.readthedocs.io/en/latest/", None),
+    "urllib3": ("https://urllib3.readthedocs.io/en/stable/", None),
+    "aiohttp": ("https://docs.aiohttp.org/en/stable/", None),
 }
 
 # The theme to use for HTML and HTML Help pages.  See the documentation for
@@ -10,8 +10,28 @@ A sunpy FIDO plugin for accessing data in the Solar Orbiter Archive (SOAR).
 """
 
 # Import here to register the client with sunpy
-from sunpy_soar.client import SOARClient
+from sunpy_soar.client import (SOARClient, SOARQueryCache, SOARSyncState,
+                               SOARTapJob)
+from sunpy_soar.metrics import SOARMetrics
 
 from .version import version as __version__
 
-__all__ = ["SOARClient", "__version__"]
+__all__ = [
+    "SOARClient",
+    "SOARMetrics",
+    "SOARMirror",
+    "SOARQueryCache",
+    "SOARSyncState",
+    "SOARTapJob",
+    "__version__",
+]
+
+
+def __getattr__(name):
+    # The mirror is imported on first use, so that importing sunpy_soar does not import sqlite3
+    if name == "SOARMirror":
+        from sunpy_soar.mirror import SOARMirror  # NOQA: PLC0415
+
+        return SOARMirror
+    msg = f"module {__name__!r} has no attribute {name!r}"
+    raise AttributeError(msg)
@@ -94,7 +94,7 @@ def create_or(wlk, tree):
     Loops through the next level down in the tree and appends the
     individual results to a list.
     """
-    return [wlk.create(sub) for sub in tree.attrs]
+    return [query for sub in tree.attrs for query in wlk.create(sub)]
 
 
 @walker.add_creator(AttrAnd, DataAttr)
@@ -3,22 +3,1126 @@ This file defines the SOARClient class which is used to access the Solar
 Orbiter Archive (SOAR).
 """
 
+import asyncio
+import codecs
+import contextlib
+import hashlib
+import io
 import json
+import os
 import pathlib
 import re
-from copy import copy
-from json.decoder import JSONDecodeError
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, lru_cache, partial
+from itertools import pairwise
+from json.decoder import JSONDecodeError, JSONDecoder
+from typing import NamedTuple
 
+import astropy.io.ascii
+import astropy.io.votable
 import astropy.table
 import astropy.units as u
+import numpy as np
 import requests
 import sunpy.net.attrs as a
-from sunpy import log
-from sunpy.net.attr import and_
+from requests.adapters import HTTPAdapter
+from sunpy import config, log
+from sunpy.net.attr import AttrAnd, AttrOr, and_, or_
 from sunpy.net.base_client import BaseClient, QueryResponseTable
 from sunpy.time import parse_time
+from sunpy.util.decorators import deprecated
+from sunpy.util.exceptions import SunpyUserWarning
+from urllib3.util.retry import Retry
 
-__all__ = ["SOARClient"]
+from sunpy_soar.metrics import _increment, _span
+
+__all__ = ["SOARClient", "SOARQueryCache", "SOARSyncState", "SOARTapJob"]
+
+_TAP_ENDPOINT = "http://soar.esac.esa.int/soar-sl-tap/tap"
+
+# Server errors after which a query is retried
+_RETRY_STATUSES = (500, 502, 503, 504)
+
+# Mapping between the SOAR column names and the column names of the results table.
+_COLUMN_NAMES = {
+    "instrument": "Instrument",
+    "descriptor": "Data product",
+    "level": "Level",
+    "begin_time": "Start time",
+    "end_time": "End time",
+    "data_item_id": "Data item ID",
+    "filename": "Filename",
+    "filesize": "Filesize",
+    "soop_name": "SOOP Name",
+    "detector": "Detector",
+    "sensor": "Sensor",
+    "wavelength": "Wavelength",
+}
+# Columns selected by default from the data item tables.
+_DEFAULT_COLUMNS = (
+    "instrument",
+    "descriptor",
+    "level",
+    "begin_time",
+    "end_time",
+    "data_item_id",
+    "filesize",
+    "filename",
+    "soop_name",
+)
+# Columns which are always selected, as they are needed to sort, page and download the results.
+_REQUIRED_COLUMNS = ("level", "begin_time", "data_item_id", "filename")
+# Columns which are selected from the instrument tables of remote-sensing instruments.
+_INSTRUMENT_COLUMNS = ("detector", "wavelength")
+# Columns of the results of aggregating queries, see ``SOARClient.summary``.
+_AGGREGATE_COLUMN_NAMES = {"n_files": "Number of files", "total_size": "Total size"}
+# The response formats of the TAP service which can be read, and their names in error messages.
+_RESPONSE_FORMATS = {"json": "JSON", "csv": "CSV", "votable": "VOTable"}
+# What a search can do when a query matches more than ``max_rows`` files.
+_ON_MAX_ROWS = ("warn", "raise", "split", "jobs")
+# The query item for the time range of a query, as created by the attrs walker.
+_TIME_RANGE = re.compile(r"begin_time>='([^']*)' AND begin_time<='([^']*)'")
+# The column and (first) value of a query item, such as ``instrument='EUI'`` or ``level IN ('L1', 'L2')``.
+_ITEM_VALUE = re.compile(r"(\w+)(?:=| IN \()'([^']*)'")
+# Columns whose values are merged into one ``IN`` condition when sub-queries only differ in them.
+_MERGE_COLUMNS = ("instrument", "descriptor", "level", "soop_name")
+# The wavelength range query items, as created by the attrs walker.
+_WAVEMIN = re.compile(r"Wavemin='(\d+\.\d+)'")
+_WAVEMAX = re.compile(r"Wavemax='(\d+\.\d+)'")
+# Mapping between the SOAR instrument names and the alias used in the name of their instrument table.
+_INSTRUMENT_TABLE_ALIASES = {
+    "SOLOHI": "SHI",
+    "EUI": "EUI",
+    "STIX": "STX",
+    "SPICE": "SPI",
+    "PHI": "PHI",
+    "METIS": "MET",
+}
+# The remote-sensing instruments whose data table is joined with their instrument table.
+_JOIN_INSTRUMENTS = ("EUI", "MET", "SPI", "PHI", "SHI")
+# The number of files downloaded from the SOAR at the same time by ``fetch_async``.
+_DOWNLOAD_MAX_CONNECTIONS = 5
+# The VOTable datatypes of the columns which are not strings, for responses which do not describe their columns.
+_COLUMN_DATATYPES = {"filesize": "long", "wavelength": "double", "n_files": "long", "total_size": "long"}
+# Mapping between the VOTable datatypes given in the TAP metadata and numpy dtypes.
+_VOTABLE_DTYPES = {
+    "boolean": np.bool_,
+    "short": np.int64,
+    "int": np.int64,
+    "long": np.int64,
+    "float": np.float64,
+    "double": np.float64,
+    "char": np.str_,
+    "unicodeChar": np.str_,
+}
+
+
+def _column_array(values, datatype):
+    """
+    Convert the values of one column of a TAP response to an array.
+
+    Parameters
+    ----------
+    values : sequence
+        The values of the column, `None` for null values. Arrays are
+        returned unchanged.
+    datatype : str or None
+        The VOTable datatype of the column.
+
+    Returns
+    -------
+    numpy.ndarray or astropy.table.MaskedColumn
+        The column, masked where the values are null.
+    """
+    if isinstance(values, np.ndarray):
+        return values
+    dtype = _VOTABLE_DTYPES.get(datatype)
+    if None not in values:
+        return np.asarray(values, dtype=dtype)
+    mask = np.fromiter((value is None for value in values), dtype=bool, count=len(values))
+    fill_value = "" if dtype is np.str_ else 0
+    filled = [fill_value if value is None else value for value in values]
+    return astropy.table.MaskedColumn(np.asarray(filled, dtype=dtype), mask=mask)
+
+
+def _iso_times(values):
+    """
+    Convert a column of timestamps returned by the SOAR to ISO strings.
+
+    Parameters
+    ----------
+    values : sequence of str
+        Timestamps in ISO 8601 format.
+
+    Returns
+    -------
+    numpy.ndarray
+        The timestamps in the same format as ``astropy.time.Time.iso``.
+    """
+    # numpy deprecates parsing timestamps with a timezone, the SOAR gives them in UTC
+    strings = np.char.rstrip(np.asarray(values, dtype=str), "Z")
+    try:
+        times = strings.astype("datetime64[ns]")
+    except ValueError:
+        # numpy can not parse everything astropy can, e.g. leap seconds
+        return parse_time(list(values)).iso
+    # Round to the nearest millisecond like astropy, casting to milliseconds truncates
+    times = (times + np.timedelta64(500_000, "ns")).astype("datetime64[ms]")
+    return np.char.replace(np.datetime_as_string(times, unit="ms"), "T", " ")
+
+
+def _columns_from_table(table, *, datatypes=None):
+    """
+    Get the columns of a CSV or VOTable TAP response read by astropy.
+
+    Parameters
+    ----------
+    table : astropy.table.Table
+        The response.
+    datatypes : dict[str, str], optional
+        The VOTable datatypes of the columns, for responses read as strings
+        which do not describe their columns. Columns not given are strings.
+
+    Returns
+    -------
+    tuple[list[dict], list[sequence]]
+        The column descriptions and the values of each column.
+
+    Raises
+    ------
+    ValueError
+        If the response does not contain the columns of a query result.
+    """
+    if not set(table.colnames) & (_COLUMN_NAMES.keys() | _AGGREGATE_COLUMN_NAMES.keys()):
+        msg = "Response does not contain the query result columns"
+        raise ValueError(msg)
+    if datatypes is not None:
+        metadata = [{"name": name, "datatype": datatypes.get(name, "char")} for name in table.colnames]
+        columns = []
+        for column, description in zip(table.itercols(), metadata, strict=True):
+            dtype = _VOTABLE_DTYPES[description["datatype"]]
+            mask = getattr(column, "mask", None)
+            if mask is None or not mask.any():
+                columns.append(np.asarray(column, dtype=dtype))
+                continue
+            values = np.asarray(column.filled("" if dtype is np.str_ else "0")).astype(dtype)
+            columns.append(astropy.table.MaskedColumn(values, mask=mask))
+        return metadata, columns
+    columns = []
+    for column in table.itercols():
+        if column.dtype.kind != "O":
+            columns.append(column)
+            continue
+        # Variable length strings in a VOTable are read as objects
+        mask = getattr(column, "mask", None)
+        values = np.asarray(column.filled("") if mask is not None else column, dtype=np.str_)
+        columns.append(astropy.table.MaskedColumn(values, mask=mask))
+    return [{"name": name} for name in table.colnames], columns
+
+
+class _TAPJSONStreamParser:
+    """
+    Incrementally parse a TAP JSON response into columns.
+
+    The response is passed in chunks to `feed`, and each row of the ``data``
+    array is moved into the columns as soon as it has been received. Every
+    ``chunk_rows`` rows the columns are converted to arrays, so that neither
+    the whole response text nor a Python object for every value is ever held
+    in memory.
+
+    Parameters
+    ----------
+    chunk_rows : int, optional
+        The number of rows collected before they are converted to arrays.
+    """
+
+    _whitespace = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self, chunk_rows=10_000) -> None:
+        self.chunk_rows = chunk_rows
+        self._decoder = JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._state = "start"
+        self._key = None
+        self._final = False
+        self.metadata = None
+        self._rows = None
+        self._chunks = None
+
+    def feed(self, chunk) -> None:
+        """
+        Parse the next chunk of the response.
+
+        Parameters
+        ----------
+        chunk : bytes
+            The next part of the response body.
+        """
+        self._buffer = self._buffer[self._pos :] + self._text_decoder.decode(chunk)
+        self._pos = 0
+        self._parse()
+
+    def close(self):
+        """
+        Finish parsing the response.
+
+        Returns
+        -------
+        tuple[list[dict], list[list]]
+            The column descriptions and the values of each column.
+
+        Raises
+        ------
+        json.JSONDecodeError
+            If the response is not a complete TAP JSON response.
+        """
+        self._buffer = self._buffer[self._pos :] + self._text_decoder.decode(b"", final=True)
+        self._pos = 0
+        self._final = True
+        self._parse()
+        if self._state != "end" or self.metadata is None:
+            msg = "Incomplete TAP response"
+            raise JSONDecodeError(msg, self._buffer, self._pos)
+        if self._rows is None:
+            return self.metadata, [[] for _ in self.metadata]
+        self._flush()
+        columns = []
+        while self._chunks:
+            # Join the chunks one column at a time to limit the extra memory needed
+            chunks = self._chunks.pop(0)
+            if any(isinstance(chunk, np.ma.MaskedArray) for chunk in chunks):
+                columns.append(astropy.table.MaskedColumn(np.ma.concatenate(chunks)))
+            else:
+                columns.append(np.concatenate(chunks))
+        return self.metadata, columns
+
+    def _add_row(self, row) -> None:
+        if self._rows is None:
+            self._rows = [[] for _ in row]
+            self._chunks = [[] for _ in row]
+        for column, value in zip(self._rows, row, strict=True):
+            column.append(value)
+        if len(self._rows[0]) >= self.chunk_rows:
+            self._flush()
+
+    def _flush(self) -> None:
+        # The metadata normally comes before the data, if not the dtypes are inferred
+        datatypes = [column.get("datatype") for column in self.metadata or [{}] * len(self._rows)]
+        for chunks, values, datatype in zip(self._chunks, self._rows, datatypes, strict=True):
+            if values:
+                chunks.append(_column_array(values, datatype))
+                values.clear()
+
+    def _next_char(self):
+        # Skip whitespace and return the next character, or None if the
+        # buffer has been used up.
+        self._pos = self._whitespace.match(self._buffer, self._pos).end()
+        return self._buffer[self._pos] if self._pos < len(self._buffer) else None
+
+    def _decode_value(self):
+        # Decode the JSON value at the current position, returning
+        # (True, value) if it is complete and (False, None) if more of the
+        # response is needed.
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except JSONDecodeError:
+            if self._final:
+                raise
+            return False, None
+        # A number may continue in the next chunk, so a value is only complete
+        # once the character following it has been received.
+        if not self._final and (end == len(self._buffer) or self._buffer[end] not in " \t\n\r,:]}"):
+            return False, None
+        self._pos = end
+        return True, value
+
+    def _expect(self, char, expected):
+        if char not in expected:
+            msg = f"Expecting one of {expected!r}"
+            raise JSONDecodeError(msg, self._buffer, self._pos)
+
+    def _parse(self) -> None:
+        while (char := self._next_char()) is not None:
+            if self._state == "start":
+                self._expect(char, "{")
+                self._pos += 1
+                self._state = "key"
+            elif self._state == "key":
+                if char == "}":
+                    self._pos += 1
+                    self._state = "end"
+                    continue
+                complete, self._key = self._decode_value()
+                if not complete:
+                    return
+                self._state = "colon"
+            elif self._state == "colon":
+                self._expect(char, ":")
+                self._pos += 1
+                self._state = "data" if self._key == "data" else "value"
+            elif self._state == "value":
+                complete, value = self._decode_value()
+                if not complete:
+                    return
+                if self._key == "metadata":
+                    self.metadata = value
+                self._state = "next_key"
+            elif self._state == "next_key":
+                self._expect(char, ",}")
+                self._pos += 1
+                self._state = "key" if char == "," else "end"
+            elif self._state == "data":
+                self._expect(char, "[")
+                self._pos += 1
+                self._state = "row"
+            elif self._state == "row":
+                if char == "]":
+                    self._pos += 1
+                    self._state = "next_key"
+                    continue
+                complete, row = self._decode_value()
+                if not complete:
+                    return
+                self._add_row(row)
+                self._state = "next_row"
+            elif self._state == "next_row":
+                self._expect(char, ",]")
+                self._pos += 1
+                self._state = "row" if char == "," else "next_key"
+            else:
+                msg = "Extra data"
+                raise JSONDecodeError(msg, self._buffer, self._pos)
+
+
+def _file_size(path):
+    """
+    Get the size of a file.
+
+    Parameters
+    ----------
+    path : str
+        The path to the file.
+
+    Returns
+    -------
+    `~astropy.units.Quantity` or None
+        The size of the file, or `None` if it does not exist.
+    """
+    try:
+        return pathlib.Path(path).stat().st_size * u.byte
+    except FileNotFoundError:
+        return None
+
+
+def _drop_duplicates(table, seen):
+    """
+    Remove the rows of a table of query results whose data item ID is in
+    ``seen`` or repeats an earlier row, and add the other IDs to ``seen``.
+
+    Parameters
+    ----------
+    table : astropy.table.QTable
+        Query results.
+    seen : set[str]
+        The data item IDs of the results kept so far.
+
+    Returns
+    -------
+    astropy.table.QTable
+        The rows of ``table`` which were not seen before.
+    """
+    if "Data item ID" not in table.colnames:
+        return table
+    keep = np.ones(len(table), dtype=bool)
+    for row, data_item_id in enumerate(table["Data item ID"].tolist()):
+        if data_item_id in seen:
+            keep[row] = False
+        else:
+            seen.add(data_item_id)
+    return table if keep.all() else table[keep]
+
+
+def _invalid_response_error(response_format):
+    """
+    Create the error raised when the SOAR returns a response which can not be
+    read.
+
+    Parameters
+    ----------
+    response_format : str
+        The format of the response.
+
+    Returns
+    -------
+    RuntimeError
+    """
+    msg = (
+        f"The SOAR server returned an invalid {_RESPONSE_FORMATS[response_format]} response. "
+        "It may be down or not functioning correctly."
+    )
+    return RuntimeError(msg)
+
+
+def _table_from_columns(metadata, columns, *, metrics=None):
+    """
+    Build the results table from the columns of a TAP response.
+
+    Parameters
+    ----------
+    metadata : list[dict]
+        The column descriptions from the TAP response.
+    columns : list[sequence]
+        The values of each column, in the same order as ``metadata``.
+    metrics : `~sunpy_soar.SOARMetrics`, optional
+        If given, the time taken to convert the times is recorded.
+
+    Returns
+    -------
+    astropy.table.QTable
+        The results table.
+    """
+    info = {
+        column["name"]: _column_array(values, column.get("datatype"))
+        for column, values in zip(metadata, columns, strict=True)
+    }
+    for name in ("begin_time", "end_time"):
+        if name in info and len(info[name]):
+            with _span(metrics, "parse_time", rows=len(info[name])):
+                info[name] = _iso_times(info[name])
+
+    column_names = _COLUMN_NAMES | _AGGREGATE_COLUMN_NAMES
+    names = [name for name in column_names if name in info]
+    return astropy.table.QTable(
+        [info[name] for name in names], names=[column_names[name] for name in names], copy=False
+    )
+
+
+@cache
+def _dataset_values():
+    """
+    Read the values of the SOAR attributes from the JSON files in ``data/``.
+
+    The files are read the first time this is called, later calls return the
+    same dictionary.
+
+    Returns
+    -------
+    dict
+        The values of each attribute, as a list of ``(name, description)`` tuples.
+    """
+    from sunpy_soar.attrs import SOOP, Product, Sensor  # NOQA: PLC0415
+
+    data_dir = pathlib.Path(__file__).parent / "data"
+    values = {}
+    for attr, filename in (
+        (Product, "attrs.json"),
+        (a.Instrument, "instrument_attrs.json"),
+        (Sensor, "sensor_attrs.json"),
+        (SOOP, "soop_attrs.json"),
+    ):
+        with (data_dir / filename).open() as attrs_file:
+            # Convert from dict to list of tuples
+            values[attr] = list(json.load(attrs_file).items())
+    values[a.Provider] = [("SOAR", "Solar Orbiter Archive.")]
+    return values
+
+
+@cache
+def _instrument_names():
+    """
+    Get the lower case names of the instruments in the SOAR.
+
+    Returns
+    -------
+    frozenset[str]
+    """
+    return frozenset(name.lower() for name, _ in _dataset_values()[a.Instrument])
+
+
+def _join_condition(parameter):
+    """
+    Qualify a query item with the alias of the table it selects from, when the
+    data table is joined with an instrument table.
+
+    Parameters
+    ----------
+    parameter : str
+        A query item other than the time range.
+
+    Returns
+    -------
+    str
+        The condition in the WHERE part of the query.
+    """
+    wavemin_match = _WAVEMIN.search(parameter)
+    wavemax_match = _WAVEMAX.search(parameter)
+    # If the wavemin and wavemax are same that means only one wavelength is given in query.
+    if wavemin_match and wavemax_match and float(wavemin_match.group(1)) == float(wavemax_match.group(1)):
+        # For PHI and SPICE, we can specify wavemin and wavemax in the query and get the results.
+        # For PHI we have wavelength data in both angstrom and nanometer without it being mentioned in the SOAR.
+        # For SPICE we get data in form of wavemin/wavemax columns, but only for the first spectral window.
+        # To make sure this data is not misleading to the user we do not return any values for PHI AND SPICE.
+        parameter = f"Wavelength='{wavemin_match.group(1)}'"
+    elif wavemin_match and wavemax_match:
+        parameter = f"Wavemin='{wavemin_match.group(1)}' AND h2.Wavemax='{wavemax_match.group(1)}'"
+    prefix = "h2." if parameter.startswith(("Detector", "Wave")) else "h1."
+    return f"{prefix}{parameter}"
+
+
+def _time_condition(start, end, *, alias="", dimension_index=False):
+    """
+    Create the condition in the WHERE part of the query selecting a time range.
+
+    Parameters
+    ----------
+    start, end : str
+        The time range.
+    alias : str, optional
+        The alias of the data table.
+    dimension_index : bool, optional
+        Whether to only select the first dimension of the joined instrument
+        table, to avoid duplicate rows.
+
+    Returns
+    -------
+    str
+    """
+    condition = f"{alias}begin_time>='{start}' AND {alias}begin_time<='{end}'"
+    if dimension_index:
+        condition += " AND h2.dimension_index='1'"
+    return condition
+
+
+class _QueryPlan(NamedTuple):
+    """
+    The parts of the ADQL query for a list of query items which do not depend
+    on the time range of the query.
+
+    Plans are created by `_query_plan`.
+    """
+
+    #: The TAP REQUEST method.
+    query_method: str
+    #: The data item table selected from.
+    data_table: str
+    #: The instrument table joined with the data table, or `None`.
+    instrument_table: str | None
+    #: The conditions in the WHERE part of the query, with `None` in place of the time range.
+    conditions: tuple
+    #: The distance filter, or `None`.
+    distance: str | None
+
+    @property
+    def join(self):
+        return self.instrument_table is not None
+
+    @property
+    def alias(self):
+        """
+        The prefix of the columns of the data table.
+        """
+        return "h1." if self.join else ""
+
+    @property
+    def from_part(self):
+        """
+        The FROM part of the query.
+        """
+        if self.join:
+            return f"{self.data_table} AS h1 JOIN {self.instrument_table} AS h2 USING (data_item_oid)"
+        return self.data_table
+
+    def where_part(self, time_range=None):
+        """
+        Create the WHERE part of the query.
+
+        Parameters
+        ----------
+        time_range : tuple[str, str], optional
+            The time range of the query.
+
+        Returns
+        -------
+        str
+        """
+        conditions = [
+            _time_condition(*time_range, alias=self.alias, dimension_index=self.join) if condition is None else condition
+            for condition in self.conditions
+        ]
+        if not conditions and self.distance is not None:
+            return self.distance
+        return " AND ".join(conditions)
+
+
+@lru_cache(maxsize=1024)
+def _query_plan(items):
+    """
+    Plan the ADQL query for a list of query items.
+
+    The plan is cached, so that queries which only differ in their time
+    range, such as the time windows of a search, are only planned once.
+
+    Parameters
+    ----------
+    items : tuple
+        The query items, with `None` in place of the time range.
+
+    Returns
+    -------
+    _QueryPlan
+    """
+    data_table = "v_sc_data_item"
+    instrument_name = None
+    distance = None
+    conditions = []
+    for item in items:
+        if item is not None and "DISTANCE" in item:
+            distance = item
+            continue
+        conditions.append(item)
+        match = None if item is None else _ITEM_VALUE.match(item)
+        if match is None:
+            continue
+        # Sub-queries are only merged if all values use the same tables, so the first value decides them
+        column, value = match.groups()
+        if column == "instrument" or (column == "descriptor" and not instrument_name):
+            instrument_name = value.split("-")[0].upper()
+        elif column == "level" and value[:2] == "LL":
+            data_table = "v_ll_data_item"
+
+    instrument_table = None
+    instrument_name = _INSTRUMENT_TABLE_ALIASES.get(instrument_name, instrument_name)
+    # Need to establish join for remote sensing instruments as they have instrument tables in SOAR.
+    if instrument_name in _JOIN_INSTRUMENTS:
+        instrument_table = f"v_{instrument_name.lower()}_{'ll' if data_table == 'v_ll_data_item' else 'sc'}_fits"
+        conditions = [None if condition is None else _join_condition(condition) for condition in conditions]
+    return _QueryPlan(
+        query_method="doQuery" if distance is None else "doQueryFilteredByDistance",
+        data_table=data_table,
+        instrument_table=instrument_table,
+        conditions=tuple(conditions),
+        distance=distance,
+    )
+
+
+def _plan_query(query):
+    """
+    Plan the ADQL query for a list of query items.
+
+    Parameters
+    ----------
+    query : list[str]
+        List of query items.
+
+    Returns
+    -------
+    tuple[_QueryPlan, tuple[str, str] or None]
+        The plan of the query, and its time range.
+    """
+    time_range = None
+    items = []
+    for item in query:
+        # The query is planned without its time range, so that the plan is reused for other time ranges
+        match = _TIME_RANGE.fullmatch(item)
+        if match:
+            time_range = match.groups()
+        items.append(None if match else item)
+    return _query_plan(tuple(items)), time_range
+
+
+def _merge_queries(queries):
+    """
+    Merge sub-queries which can be sent to the SOAR as one query.
+
+    Duplicate sub-queries are removed, and sub-queries which only differ in
+    the value of one of ``_MERGE_COLUMNS`` and select from the same tables are
+    replaced by one sub-query selecting all of the values with ``IN``.
+
+    Parameters
+    ----------
+    queries : list[list[str]]
+        The query items of each sub-query.
+
+    Returns
+    -------
+    list[list[str]]
+        The query items of the merged sub-queries, in the order in which they
+        first appear in ``queries``.
+    """
+    queries = list(dict.fromkeys(tuple(query) for query in queries))
+    for column in _MERGE_COLUMNS:
+        groups = {}
+        for query in queries:
+            matches = [i for i, item in enumerate(query) if item.startswith(f"{column}='")]
+            if len(matches) != 1:
+                groups[query] = [query]
+                continue
+            index = matches[0]
+            plan = _query_plan(tuple(None if _TIME_RANGE.fullmatch(item) else item for item in query))
+            key = (query[:index], query[index + 1 :], plan.data_table, plan.instrument_table)
+            groups.setdefault(key, []).append(query)
+        queries = []
+        for group in groups.values():
+            if len(group) == 1:
+                queries.append(group[0])
+                continue
+            index = next(i for i, item in enumerate(group[0]) if item.startswith(f"{column}='"))
+            values = ", ".join(query[index].split("=", 1)[1] for query in group)
+            queries.append((*group[0][:index], f"{column} IN ({values})", *group[0][index + 1 :]))
+    return [list(query) for query in queries]
+
+
+class SOARQueryCache:
+    """
+    An on-disk cache of SOAR query results.
+
+    Results are stored as ECSV files named after a hash of the query sent to
+    the SOAR, so repeating a search returns the stored table without
+    contacting the SOAR.
+
+    Parameters
+    ----------
+    directory : str or `pathlib.Path`, optional
+        The directory the results are stored in. Defaults to
+        ``soar_query_cache`` inside the sunpy working directory.
+    expiry : `~astropy.units.Quantity`, optional
+        How long a stored result is used for before the SOAR is queried again.
+        Defaults to 1 day.
+    max_size : `~astropy.units.Quantity`, optional
+        The maximum total size of the stored results. When it is exceeded the
+        least recently used results are removed. Defaults to 100 Mbyte.
+    """
+
+    @u.quantity_input(expiry=u.s, max_size=u.byte)
+    def __init__(self, directory=None, *, expiry=1 * u.day, max_size=100 * u.Mbyte) -> None:
+        if directory is None:
+            directory = pathlib.Path(config.get("general", "working_dir")) / "soar_query_cache"
+        self.directory = pathlib.Path(directory).expanduser()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.expiry = expiry
+        self.max_size = max_size
+
+    def _path(self, payload):
+        # Normalize the payload so that equivalent queries share an entry
+        normalized = {key: " ".join(str(value).split()) for key, value in payload.items()}
+        key = hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+        return self.directory / f"{key}.ecsv"
+
+    def get(self, payload):
+        """
+        Return the stored result of a query.
+
+        Parameters
+        ----------
+        payload : dict
+            The query payload, as built by ``SOARClient._construct_payload``.
+
+        Returns
+        -------
+        astropy.table.QTable or None
+            The stored result, or `None` if there is no result for this query
+            or it has expired.
+        """
+        path = self._path(payload)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        now = time.time()
+        if now - stat.st_mtime > self.expiry.to_value(u.s):
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            table = astropy.table.QTable.read(path, format="ascii.ecsv")
+            # The access time records when an entry was last used, for eviction.
+            # The modification time is kept as the time the entry was stored.
+            os.utime(path, (now, stat.st_mtime))
+        except FileNotFoundError:
+            # The entry was removed by another process since it was found
+            return None
+        return table
+
+    def set(self, payload, table) -> None:
+        """
+        Store the result of a query.
+
+        Parameters
+        ----------
+        payload : dict
+            The query payload, as built by ``SOARClient._construct_payload``.
+        table : astropy.table.QTable
+            The query result.
+        """
+        path = self._path(payload)
+        # Write to a temporary file first so that concurrent readers never see
+        # a partially written result.
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        table.write(tmp_path, format="ascii.ecsv", overwrite=True)
+        tmp_path.replace(path)
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for path in self.directory.glob("*.ecsv"):
+            # Entries may be removed by another process at any time
+            with contextlib.suppress(FileNotFoundError):
+                entries.append((path, path.stat()))
+        total_size = sum(stat.st_size for _, stat in entries)
+        max_size = self.max_size.to_value(u.byte)
+        for path, stat in sorted(entries, key=lambda entry: entry[1].st_atime):
+            if total_size <= max_size:
+                break
+            path.unlink(missing_ok=True)
+            total_size -= stat.st_size
+
+    def clear(self) -> None:
+        """
+        Remove all stored results.
+        """
+        for path in self.directory.glob("*.ecsv"):
+            path.unlink(missing_ok=True)
+
+
+class SOARSyncState:
+    """
+    The progress of incremental searches, stored on disk.
+
+    For each query, ignoring its time range, the latest start time of the
+    files found so far (the high-water mark) is stored, together with the
+    files which start within ``overlap`` of it. Later incremental searches
+    only ask the SOAR for files starting after the high-water mark minus
+    ``overlap``, and skip the files which were already found.
+
+    The SOAR tables do not record when a file was added, so files added to
+    the SOAR more than ``overlap`` after files which start later than them
+    are not found by incremental searches.
+
+    Parameters
+    ----------
+    path : str or `pathlib.Path`, optional
+        The JSON file the state is stored in. Defaults to
+        ``soar_sync_state.json`` inside the sunpy working directory.
+    overlap : `~astropy.units.Quantity`, optional
+        How long before the high-water mark incremental searches start.
+        Defaults to 1 day.
+    """
+
+    @u.quantity_input(overlap=u.s)
+    def __init__(self, path=None, *, overlap=1 * u.day) -> None:
+        if path is None:
+            path = pathlib.Path(config.get("general", "working_dir")) / "soar_sync_state.json"
+        self.path = pathlib.Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.overlap = overlap
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(query):
+        # Searches for the same files over different time ranges share their progress
+        return " AND ".join(sorted(item for item in query if not _TIME_RANGE.fullmatch(item)))
+
+    def _read(self):
+        try:
+            return json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return {}
+
+    def _start(self, high_water_mark):
+        return (parse_time(high_water_mark) - self.overlap).strftime("%Y-%m-%d %H:%M:%S")
+
+    def since(self, query):
+        """
+        Restrict a query to the files which may not have been found yet.
+
+        Parameters
+        ----------
+        query : list[str]
+            List of query items, which must include a time range.
+
+        Returns
+        -------
+        list[str]
+            The query items with the start of the time range moved to the
+            high-water mark minus ``overlap``, if that is later.
+        set[str]
+            The data item IDs of files starting after that time which were
+            already found.
+        """
+        entry = self._read().get(self._key(query))
+        if entry is None:
+            return query, set()
+        start = self._start(entry["high_water_mark"])
+        since = []
+        for item in query:
+            match = _TIME_RANGE.fullmatch(item)
+            if match:
+                item = f"begin_time>='{max(start, match.group(1))}' AND begin_time<='{match.group(2)}'"
+            since.append(item)
+        return since, set(entry["recent"])
+
+    def update(self, query, table) -> None:
+        """
+        Record the files found by a query.
+
+        Parameters
+        ----------
+        query : list[str]
+            List of query items.
+        table : astropy.table.QTable
+            The files found by the query.
+        """
+        if not len(table):
+            return
+        with self._lock:
+            state = self._read()
+            key = self._key(query)
+            entry = state.get(key, {"high_water_mark": "", "recent": {}})
+            found = dict(zip(table["Data item ID"].tolist(), table["Start time"].tolist(), strict=True))
+            recent = entry["recent"] | found
+            high_water_mark = max(entry["high_water_mark"], *found.values())
+            start = self._start(high_water_mark)
+            state[key] = {
+                "high_water_mark": high_water_mark,
+                "recent": {data_item_id: time for data_item_id, time in recent.items() if time >= start},
+            }
+            # Write to a temporary file first so that the state is never partially written
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_text(json.dumps(state, indent=1, sort_keys=True))
+            tmp_path.replace(self.path)
+
+    def clear(self) -> None:
+        """
+        Forget the progress of all incremental searches.
+        """
+        self.path.unlink(missing_ok=True)
+
+
+class SOARTapJob:
+    """
+    A query running as an asynchronous job on the SOAR TAP service.
+
+    Jobs are created with `SOARClient.submit_jobs`. A job is identified by its
+    URL, so a job submitted in one process can be resumed in another by
+    creating a new ``SOARTapJob`` with the same URL.
+
+    Parameters
+    ----------
+    url : str
+        The URL of the job.
+    response_format : {"json", "csv", "votable"}, optional
+        The format of the job results, as requested when it was submitted.
+        Defaults to "json".
+    client : `SOARClient`, optional
+        The client used to send requests about the job and to read its
+        results. Defaults to a new client.
+    """
+
+    #: The default initial number of seconds between checks of the job phase.
+    poll_interval = 1
+    #: The default maximum number of seconds between checks of the job phase.
+    max_poll_interval = 30
+
+    def __init__(self, url, *, response_format="json", client=None) -> None:
+        self.url = url
+        self.response_format = response_format
+        self.client = client if client is not None else SOARClient()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.url!r}, response_format={self.response_format!r})"
+
+    @property
+    def phase(self):
+        """
+        The execution phase of the job, e.g. "EXECUTING" or "COMPLETED".
+        """
+        r = self.client.session.get(f"{self.url}/phase", timeout=self.client.timeout)
+        r.raise_for_status()
+        return r.text.strip()
+
+    def wait(self, *, timeout=None, poll_interval=None, max_poll_interval=None):
+        """
+        Wait for the job to finish.
+
+        The phase of the job is checked with an increasing interval, starting
+        at ``poll_interval`` and doubling after each check up to
+        ``max_poll_interval``.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The maximum number of seconds to wait. By default there is no limit.
+        poll_interval : float, optional
+            The initial number of seconds between checks. Defaults to
+            `SOARTapJob.poll_interval`.
+        max_poll_interval : float, optional
+            The maximum number of seconds between checks. Defaults to
+            `SOARTapJob.max_poll_interval`.
+
+        Raises
+        ------
+        RuntimeError
+            If the job failed or was aborted.
+        TimeoutError
+            If the job did not finish within ``timeout`` seconds.
+        """
+        poll_interval = self.poll_interval if poll_interval is None else poll_interval
+        max_poll_interval = self.max_poll_interval if max_poll_interval is None else max_poll_interval
+        start = time.monotonic()
+        while (phase := self.phase) != "COMPLETED":
+            if phase in ("ERROR", "ABORTED"):
+                msg = f"The SOAR job {self.url} finished with phase {phase}."
+                raise RuntimeError(msg)
+            if timeout is not None and time.monotonic() - start + poll_interval > timeout:
+                msg = f"The SOAR job {self.url} did not finish within {timeout} seconds."
+                raise TimeoutError(msg)
+            time.sleep(poll_interval)
+            poll_interval = min(2 * poll_interval, max_poll_interval)
+
+    def cancel(self) -> None:
+        """
+        Abort the job.
+        """
+        r = self.client.session.post(
+            f"{self.url}/phase", data={"PHASE": "ABORT"}, timeout=self.client.timeout, allow_redirects=False
+        )
+        r.raise_for_status()
+
+    def delete(self) -> None:
+        """
+        Delete the job and its results from the SOAR.
+
+        The SOAR keeps a job until it destroys it, even after its results
+        have been read, so jobs which are not needed anymore can be deleted.
+        """
+        r = self.client.session.delete(self.url, timeout=self.client.timeout, allow_redirects=False)
+        r.raise_for_status()
+
+    def result(self, **kwargs):
+        """
+        Wait for the job to finish and return its results.
+
+        The job is not deleted, see `delete`.
+
+        Parameters
+        ----------
+        **kwargs
+            Passed to `wait`.
+
+        Returns
+        -------
+        astropy.table.QTable
+            Query results.
+        """
+        self.wait(**kwargs)
+        client = self.client
+        with client.session.get(f"{self.url}/results/result", timeout=client.timeout, stream=client.stream) as r:
+            r.raise_for_status()
+            return client._parse_response(r, self.response_format)
 
 
 class SOARClient(BaseClient):
@@ -26,44 +1130,601 @@ class SOARClient(BaseClient):
     Provides access to Solar Orbiter Archive (SOAR) which provides data for
     Solar Orbiter.
 
-    References
-    ----------
-    * `SOAR <https://soar.esac.esa.int/soar/>`__
-    """
+    Parameters
+    ----------
+    max_workers : int, optional
+        The maximum number of sub-queries (the branches of an ``OR`` query)
+        that are sent to the SOAR at the same time. Set to 1 to send them one
+        after another. Defaults to 4.
+    session : `requests.Session`, optional
+        The session used to send queries to the SOAR TAP service. If not
+        given, a session is created which keeps connections to the SOAR alive
+        between queries and retries failed requests.
+    retries : int, optional
+        The number of times a query is retried after a connection error or a
+        server error (5xx) response. Only used by `search` if ``session`` is
+        not given. Defaults to 3.
+    backoff_factor : float, optional
+        The factor used to compute the exponentially increasing wait between
+        retries, in seconds. Only used by `search` if ``session`` is not
+        given. Defaults to 0.5.
+    timeout : float, optional
+        The number of seconds to wait for a response from the SOAR.
+        Defaults to 60.
+    cache : `SOARQueryCache`, optional
+        If given, query results are stored in and read from this cache.
+        By default results are not cached.
+    stream : bool, optional
+        If `True`, JSON responses from the SOAR are parsed while they are
+        being downloaded, which greatly reduces the memory needed for searches
+        with many results. Defaults to `False`.
+    response_format : {"json", "csv", "votable"}, optional
+        The format the SOAR returns query results in. CSV responses are
+        smaller and faster to read than JSON responses for searches with many
+        results. Defaults to "json".
+    time_window : `~astropy.units.Quantity`, optional
+        If given, the time range of a search is split into windows of at most
+        this length which are queried separately, so that searches over long
+        time ranges do not time out. Results found in more than one window are
+        only returned once. By default the time range is not split.
+    use_jobs : bool, optional
+        If `True`, each query is run as an asynchronous job on the SOAR and
+        the results are downloaded once it has finished, instead of waiting
+        for the results on an open connection. This is more reliable for
+        queries which take a long time to run. Defaults to `False`.
+    max_rows : int, optional
+        If given, `search` and `search_async` first ask the SOAR how many
+        files match each query, and do ``on_max_rows`` if there are more than
+        ``max_rows``. By default the number of files is not checked.
+    on_max_rows : {"warn", "raise", "split", "jobs"}, optional
+        What to do when a query matches more than ``max_rows`` files:
+        warn and run the query anyway, raise an error without running it,
+        split its time range into windows expected to match at most
+        ``max_rows`` files each, which are checked and split again in turn,
+        or run it as an asynchronous job.
+        Defaults to "warn".
+    mirror : `~sunpy_soar.SOARMirror`, optional
+        If given, searches are answered from this local copy of the SOAR
+        metadata instead of the SOAR.
+    merge_queries : bool, optional
+        If `True`, sub-queries which only differ in their instrument, data
+        product, level or SOOP, such as ``a.soar.Product("eui-fsi174-image") |
+        a.soar.Product("eui-fsi304-image")``, are sent to the SOAR as one
+        query, and duplicate sub-queries are only sent once.
+        Defaults to `True`.
+    metrics : `~sunpy_soar.SOARMetrics`, optional
+        If given, the time taken by each phase of searches and downloads, and
+        the number of queries, retries, bytes and rows received, are recorded
+        in it. Defaults to ``SOARClient.metrics``, which is `None` unless set,
+        so that searches made by ``Fido`` can also be recorded.
+
+    References
+    ----------
+    * `SOAR <https://soar.esac.esa.int/soar/>`__
+    """
+
+    #: The `~sunpy_soar.SOARMetrics` used by clients not given ``metrics``.
+    metrics = None
+
+    @u.quantity_input(time_window=u.s)
+    def __init__(
+        self,
+        *,
+        max_workers=4,
+        session=None,
+        retries=3,
+        backoff_factor=0.5,
+        timeout=60,
+        cache=None,
+        stream=False,
+        response_format="json",
+        time_window=None,
+        use_jobs=False,
+        max_rows=None,
+        on_max_rows="warn",
+        mirror=None,
+        merge_queries=True,
+        metrics=None,
+    ) -> None:
+        if max_workers < 1:
+            msg = "max_workers must be at least 1."
+            raise ValueError(msg)
+        if response_format not in _RESPONSE_FORMATS:
+            msg = f"response_format must be one of {list(_RESPONSE_FORMATS)}."
+            raise ValueError(msg)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.cache = cache
+        self.stream = stream
+        self.response_format = response_format
+        if time_window is not None and time_window <= 0 * u.s:
+            msg = "time_window must be positive."
+            raise ValueError(msg)
+        self.time_window = time_window
+        self.use_jobs = use_jobs
+        if max_rows is not None and max_rows < 1:
+            msg = "max_rows must be at least 1."
+            raise ValueError(msg)
+        if on_max_rows not in _ON_MAX_ROWS:
+            msg = f"on_max_rows must be one of {list(_ON_MAX_ROWS)}."
+            raise ValueError(msg)
+        self.max_rows = max_rows
+        self.on_max_rows = on_max_rows
+        self.mirror = mirror
+        self.merge_queries = merge_queries
+        if metrics is not None:
+            self.metrics = metrics
+        if session is None:
+            session = self._make_session(retries=retries, backoff_factor=backoff_factor, pool_size=max_workers)
+        self.session = session
+
+    @staticmethod
+    def _make_session(*, retries, backoff_factor, pool_size):
+        """
+        Create a session which pools connections to the SOAR and retries
+        failed queries.
+
+        Parameters
+        ----------
+        retries : int
+            Maximum number of retries for each request.
+        backoff_factor : float
+            Backoff factor between retries, see `urllib3.util.Retry`.
+        pool_size : int
+            Number of connections to keep alive for each host.
+
+        Returns
+        -------
+        requests.Session
+        """
+        # Queries to the TAP service only read data, so it is safe to retry them.
+        # The final response is returned once retries are exhausted so that
+        # ``raise_for_status`` reports the actual server error.
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=_RETRY_STATUSES,
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_size)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def search(self, *query, columns=None, **kwargs):
+        r"""
+        Query this client for a list of results.
+
+        Parameters
+        ----------
+        *args: `tuple`
+            `sunpy.net.attrs` objects representing the query.
+        columns : list[str], optional
+            The columns of the results table to return, for example
+            ``["Instrument", "Start time"]``. Only these columns are requested
+            from the SOAR, which makes searches with many results faster. The
+            columns needed to download the results are always returned.
+        **kwargs: `dict`
+            Any extra keywords to refine the search.
+            Unused by this client.
+
+        Returns
+        -------
+        A ``QueryResponseTable`` instance containing the query result.
+        """
+        with _span(self.metrics, "search") as span:
+            queries = self._walk(query)
+            results = self._do_checked_searches(queries, columns=columns)
+            table = self._merge_results([result for tables in results for result in tables])
+            span.update(sub_queries=len(queries), rows=len(table))
+        return table
+
+    def iter_search(self, *query, columns=None, page_size=10_000):
+        """
+        Query this client for a list of results, one page at a time.
+
+        Each sub-query is split into pages of at most ``page_size`` results,
+        ordered by start time, which are requested one after another as the
+        previous page is consumed. This keeps the memory needed for searches
+        with many results bounded, and the first results are available before
+        the whole search has finished.
+
+        Parameters
+        ----------
+        *query : `tuple`
+            `sunpy.net.attrs` objects representing the query.
+        columns : list[str], optional
+            The columns of the results table to return, for example
+            ``["Instrument", "Start time"]``. Only these columns are requested
+            from the SOAR, which makes searches with many results faster. The
+            columns needed to download the results are always returned.
+        page_size : int, optional
+            The maximum number of results in each page, unless more files
+            than this start within the same millisecond. Defaults to 10000.
+
+        Yields
+        ------
+        sunpy.net.base_client.QueryResponseTable
+            A page of query results.
+        """
+        for table in self._iter_pages(query, columns=columns, page_size=page_size):
+            yield self._response_table(table)
+
+    def _iter_pages(self, query, *, page_size, columns=None):
+        """
+        Query the SOAR one page of results at a time.
+
+        Parameters
+        ----------
+        query : tuple
+            `sunpy.net.attrs` objects representing the query.
+        page_size : int
+            The maximum number of results in each page.
+        columns : list[str], optional
+            The columns of the results table to select.
+
+        Yields
+        ------
+        astropy.table.QTable
+            A page of query results, as returned by `_do_search`.
+        """
+        if page_size < 1:
+            msg = "page_size must be at least 1."
+            raise ValueError(msg)
+        boundary_ids = set()
+        for sub_query in self._walk(query):
+            # Data items at the boundary between two time windows are found by both queries
+            seen_ids, boundary_ids = list(boundary_ids), set()
+            after = None
+            size = page_size
+            while True:
+                table = self._do_search(sub_query, columns=columns, page_size=size, after=after)
+                n_rows = len(table)
+                if not n_rows:
+                    break
+                last_time, last_id = max(zip(table["Start time"], table["Data item ID"], strict=True))
+                boundary_ids = set(table["Data item ID"][table["Start time"] == last_time])
+                if seen_ids:
+                    table = table[np.isin(table["Data item ID"], seen_ids, invert=True)]
+                if len(table):
+                    yield table
+                if n_rows < size:
+                    break
+                # The start times are rounded to milliseconds, so the next page starts from the earliest
+                # time rounded to the last one, and the data items it finds again are dropped
+                start = parse_time(last_time) - 0.5 * u.ms
+                start.precision = 4
+                # Each page starts again from the first data item at the last start time, so while more of
+                # them than the page size share that start time the pages are made larger until they move on
+                size = size * 2 if after is not None and start.iso == after[0] else page_size
+                after = (start.iso, last_id)
+                seen_ids = list(boundary_ids)
+
+    def search_incremental(self, *query, state, columns=None):
+        """
+        Query this client for the files which were not found by the previous
+        incremental search for the same query.
+
+        This is useful to keep a local copy of some SOAR data up to date, as
+        the SOAR is only asked for files starting around or after the latest
+        file found so far.
+
+        Parameters
+        ----------
+        *query : `tuple`
+            `sunpy.net.attrs` objects representing the query. It must include
+            an `sunpy.net.attrs.Time`.
+        state : `SOARSyncState`
+            Where the progress of incremental searches is stored. It is
+            updated with the files found by this search.
+        columns : list[str], optional
+            The columns of the results table to return.
+
+        Returns
+        -------
+        A ``QueryResponseTable`` instance containing the new files.
+        """
+        # The progress of each branch of the query is recorded separately, so they are not merged
+        queries = self._walk(query, merge=False)
+        if not all(any(_TIME_RANGE.fullmatch(item) for item in sub_query) for sub_query in queries):
+            msg = "Incremental searches must include a time range."
+            raise ValueError(msg)
+        since = [state.since(sub_query) for sub_query in queries]
+        # Cached results may be missing files which were added to the SOAR since
+        results = self._map_queries(
+            lambda sub_query: self._do_search(sub_query, use_cache=False, columns=columns),
+            [sub_query for sub_query, _ in since],
+        )
+        new_results = []
+        for sub_query, (_, found), table in zip(queries, since, results, strict=True):
+            state.update(sub_query, table)
+            new_results.append(table[np.isin(table["Data item ID"], list(found), invert=True)])
+        return self._merge_results(new_results)
+
+    def summary(self, *query, by=("Instrument", "Level")):
+        """
+        Count the files matching a query and their total size, without listing
+        the files.
+
+        The files are counted by the SOAR, so this is much faster than
+        searching for files matching queries over long time ranges.
+
+        Parameters
+        ----------
+        *query : `tuple`
+            `sunpy.net.attrs` objects representing the query.
+        by : list[str], optional
+            The columns of the results table to group the files by, for example
+            ``["Instrument", "Data product"]``. If empty, all files are counted
+            together. Defaults to ``["Instrument", "Level"]``.
+
+        Returns
+        -------
+        astropy.table.QTable
+            The number of files and their total size in each group.
+
+        Notes
+        -----
+        Files matched by more than one branch of an ``OR`` query, or by two
+        time windows if ``time_window`` is set, are counted more than once.
+        """
+        by = list(by)
+        queries = self._walk(query)
+        table = astropy.table.vstack(self._map_queries(partial(self._do_search, group_by=by), queries))
+        # The total size of no files is null
+        table["Total size"] = np.ma.filled(table["Total size"], 0)
+        if by:
+            table = table.group_by(by).groups.aggregate(np.sum)
+        else:
+            table = astropy.table.QTable(
+                {"Number of files": [table["Number of files"].sum()], "Total size": [table["Total size"].sum()]}
+            )
+        table["Total size"] = (table["Total size"] * u.byte).to(u.Mbyte).round(3)
+        return table
+
+    async def search_async(self, *query, columns=None, session=None):
+        """
+        Query this client for a list of results without blocking the event
+        loop.
+
+        The sub-queries of an ``OR`` query are sent concurrently, at most
+        ``max_workers`` at a time.
+
+        Parameters
+        ----------
+        *query : `tuple`
+            `sunpy.net.attrs` objects representing the query.
+        columns : list[str], optional
+            The columns of the results table to return, for example
+            ``["Instrument", "Start time"]``. Only these columns are requested
+            from the SOAR, which makes searches with many results faster. The
+            columns needed to download the results are always returned.
+        session : `aiohttp.ClientSession`, optional
+            The session used to send queries to the SOAR TAP service. If not
+            given, a session is created for this search.
+
+        Returns
+        -------
+        A ``QueryResponseTable`` instance containing the query result.
+        """
+        import aiohttp  # NOQA: PLC0415
+
+        if session is None:
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_workers)) as session:
+                return await self.search_async(*query, columns=columns, session=session)
+        with _span(self.metrics, "search") as span:
+            queries = self._walk(query)
+            semaphore = asyncio.Semaphore(self.max_workers)
 
-    def search(self, *query, **kwargs):
-        r"""
-        Query this client for a list of results.
+            async def do_search(query, **options):
+                async with semaphore:
+                    return await self._do_search_async(session, query, **options)
+
+            results = await asyncio.gather(
+                *[self._do_checked_search_async(do_search, query, columns=columns) for query in queries]
+            )
+            table = self._merge_results([result for tables in results for result in tables])
+            span.update(sub_queries=len(queries), rows=len(table))
+        return table
+
+    def _merge_results(self, results):
+        """
+        Combine the results of each sub-query into the table returned to the
+        user.
 
         Parameters
         ----------
-        *args: `tuple`
+        results : list[astropy.table.QTable]
+            The results of each sub-query.
+
+        Returns
+        -------
+        sunpy.net.base_client.QueryResponseTable
+        """
+        # The same file can be found by several sub-queries, for example at the boundary between
+        # two time windows, so duplicates are dropped before the results are stacked
+        with _span(self.metrics, "merge", sub_queries=len(results)) as span:
+            seen = set()
+            table = astropy.table.vstack([_drop_duplicates(result, seen) for result in results])
+            span["rows"] = len(table)
+        return self._response_table(table)
+
+    def _walk(self, query, *, merge=True):
+        """
+        Convert a query into the lists of query items sent to the SOAR.
+
+        Parameters
+        ----------
+        query : tuple
             `sunpy.net.attrs` objects representing the query.
-        **kwargs: `dict`
-            Any extra keywords to refine the search.
-            Unused by this client.
+        merge : bool, optional
+            If `False`, sub-queries are not merged even if ``merge_queries``
+            is set.
 
         Returns
         -------
-        A ``QueryResponseTable`` instance containing the query result.
+        list[list[str]]
+            The query items of each sub-query.
         """
         from sunpy_soar._attrs import walker  # NOQA: PLC0415
 
-        query = and_(*query)
-        queries = walker.create(query)
+        with _span(self.metrics, "walk") as span:
+            query = and_(*query)
+            if self.time_window is not None:
+                query = self._split_time(query, self.time_window)
+            queries = walker.create(query)
 
-        results = []
-        for query_parameters in queries:
-            if "provider='SOAR'" in query_parameters:
-                query_parameters.remove("provider='SOAR'")
-            results.append(self._do_search(query_parameters))
-        table = astropy.table.vstack(results)
+            for query_parameters in queries:
+                if "provider='SOAR'" in query_parameters:
+                    query_parameters.remove("provider='SOAR'")
+            if merge and self.merge_queries:
+                queries = _merge_queries(queries)
+            span["sub_queries"] = len(queries)
+        return queries
+
+    def _response_table(self, table):
+        """
+        Convert a table of query results into the table returned to the user.
+
+        Parameters
+        ----------
+        table : astropy.table.QTable
+            Query results.
+
+        Returns
+        -------
+        sunpy.net.base_client.QueryResponseTable
+        """
         qrt = QueryResponseTable(table, client=self)
-        qrt["Filesize"] = (qrt["Filesize"] * u.byte).to(u.Mbyte).round(3)
+        if "Filesize" in qrt.colnames:
+            qrt["Filesize"] = (qrt["Filesize"] * u.byte).to(u.Mbyte).round(3)
         qrt.hide_keys = ["Data item ID", "Filename"]
         return qrt
 
+    def submit_jobs(self, *query, columns=None):
+        """
+        Submit a query to the SOAR as asynchronous jobs.
+
+        Unlike `search`, this returns as soon as the SOAR has accepted the
+        query, without waiting for the results. This is useful for queries
+        which take a long time to run. The jobs are kept by the SOAR after
+        their results are read, until they are deleted with
+        `SOARTapJob.delete`.
+
+        Parameters
+        ----------
+        *query : `tuple`
+            `sunpy.net.attrs` objects representing the query.
+        columns : list[str], optional
+            The columns of the results table to return, for example
+            ``["Instrument", "Start time"]``. Only these columns are requested
+            from the SOAR, which makes searches with many results faster. The
+            columns needed to download the results are always returned.
+
+        Returns
+        -------
+        list[SOARTapJob]
+            One job for each sub-query.
+        """
+        return [
+            self._submit_job(self._construct_payload(q, self.response_format, columns=columns))
+            for q in self._walk(query)
+        ]
+
+    def _submit_job(self, payload):
+        """
+        Submit a query payload to the SOAR as an asynchronous job.
+
+        Parameters
+        ----------
+        payload : dict
+            Payload dictionary to be sent with the query.
+
+        Returns
+        -------
+        SOARTapJob
+            The submitted job.
+        """
+        # The parameters are sent in the same form as for synchronous queries
+        params = "&".join([f"{key}={val}" for key, val in {**payload, "PHASE": "RUN"}.items()])
+        r = self.session.post(
+            f"{_TAP_ENDPOINT}/async",
+            data=requests.utils.requote_uri(params),
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            timeout=self.timeout,
+            allow_redirects=False,
+        )
+        r.raise_for_status()
+        if "Location" not in r.headers:
+            msg = "The SOAR server did not return the location of the submitted job."
+            raise RuntimeError(msg)
+        log.debug(f"Submitted job {r.headers['Location']} for query: {payload['QUERY']}")
+        return SOARTapJob(r.headers["Location"], response_format=payload["FORMAT"], client=self)
+
+    @staticmethod
+    def _split_time(query, window):
+        """
+        Split the time ranges in a query into windows.
+
+        Parameters
+        ----------
+        query : sunpy.net.attr.Attr
+            The query.
+        window : astropy.units.Quantity
+            The maximum length of each window.
+
+        Returns
+        -------
+        sunpy.net.attr.Attr
+            The query with each `~sunpy.net.attrs.Time` longer than ``window``
+            replaced by an ``OR`` of consecutive windows covering its range.
+        """
+        if isinstance(query, AttrAnd):
+            return and_(*[SOARClient._split_time(attr, window) for attr in query.attrs])
+        if isinstance(query, AttrOr):
+            return or_(*[SOARClient._split_time(attr, window) for attr in query.attrs])
+        if not isinstance(query, a.Time) or query.end - query.start <= window:
+            return query
+        windows = []
+        start = query.start
+        while start < query.end:
+            end = min(start + window, query.end)
+            windows.append(a.Time(start, end))
+            start = end
+        return or_(*windows)
+
+    def _map_queries(self, func, queries):
+        """
+        Call ``func`` on each of ``queries``, running up to ``max_workers`` of
+        them concurrently.
+
+        Parameters
+        ----------
+        func : callable
+            Function taking a single query.
+        queries : list
+            The queries to run.
+
+        Returns
+        -------
+        list
+            The return value of ``func`` for each query, in the same order as
+            ``queries`` irrespective of the order in which they complete.
+        """
+        if self.max_workers == 1 or len(queries) <= 1:
+            return [func(query) for query in queries]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(queries))) as executor:
+            return list(executor.map(func, queries))
+
     @staticmethod
+    @deprecated(
+        "1.13",
+        message="SOARClient.add_join_to_query is deprecated, the tables of a query are chosen by its query items.",
+    )
     def add_join_to_query(query: list[str], data_table: str, instrument_table: str):
         """
         Construct the WHERE, FROM, and SELECT parts of the ADQL query.
@@ -73,56 +1734,132 @@ class SOARClient(BaseClient):
         query : list[str]
             List of query items.
         data_table : str
-            Name of the data table.
+            Name of the data table. Unused, the query is planned from its
+            query items.
         instrument_table : str
-            Name of the instrument table.
+            Name of the instrument table. Unused, the query is planned from
+            its query items.
 
         Returns
         -------
         tuple[str, str, str]
             WHERE, FROM, and SELECT parts of the query.
         """
-        final_query = ""
-        # Extract wavemin and wavemax individually
-        wavemin_pattern = re.compile(r"Wavemin='(\d+\.\d+)'")
-        wavemax_pattern = re.compile(r"Wavemax='(\d+\.\d+)'")
-        for current_parameter in query:
-            parameter = copy(current_parameter)
-            wavemin_match = wavemin_pattern.search(parameter)
-            wavemax_match = wavemax_pattern.search(parameter)
-            # If the wavemin and wavemax are same that means only one wavelength is given in query.
-            if wavemin_match and wavemax_match and float(wavemin_match.group(1)) == float(wavemax_match.group(1)):
-                # For PHI and SPICE, we can specify wavemin and wavemax in the query and get the results.
-                # For PHI we have wavelength data in both angstrom and nanometer without it being mentioned in the SOAR.
-                # For SPICE we get data in form of wavemin/wavemax columns, but only for the first spectral window.
-                # To make sure this data is not misleading to the user we do not return any values for PHI AND SPICE.
-                parameter = f"Wavelength='{wavemin_match.group(1)}'"
-            elif wavemin_match and wavemax_match:
-                parameter = f"Wavemin='{wavemin_match.group(1)}' AND h2.Wavemax='{wavemax_match.group(1)}'"
-            prefix = "h1." if not parameter.startswith("Detector") and not parameter.startswith("Wave") else "h2."
-            if parameter.startswith("begin_time"):
-                time_list = parameter.split(" AND ")
-                final_query += f"h1.{time_list[0]} AND h1.{time_list[1]} AND "
-                # As there are no dimensions in STIX, the dimension index need not be included in the query for STIX.
-                if "stx" not in instrument_table:
-                    # To avoid duplicate rows in the output table, the dimension index is set to 1.
-                    final_query += "h2.dimension_index='1' AND "
-            else:
-                final_query += f"{prefix}{parameter} AND "
+        plan, time_range = _plan_query(query)
+        return plan.where_part(time_range), plan.from_part, SOARClient._select_part(plan.data_table, join=plan.join)
 
-        where_part = final_query[:-5]
-        from_part = f"{data_table} AS h1"
-        select_part = (
-            "h1.instrument, h1.descriptor, h1.level, h1.begin_time, h1.end_time, "
-            "h1.data_item_id, h1.filesize, h1.filename, h1.soop_name"
-        )
-        if instrument_table:
-            from_part += f" JOIN {instrument_table} AS h2 USING (data_item_oid)"
-            select_part += ", h2.detector, h2.wavelength, h2.dimension_index"
-        return where_part, from_part, select_part
+    @staticmethod
+    def _select_part(data_table, *, join, columns=None, group_by=None):
+        """
+        Construct the SELECT part of the ADQL query.
+
+        Parameters
+        ----------
+        data_table : str
+            Name of the data table.
+        join : bool
+            Whether the data table is joined with an instrument table.
+        columns : list[str], optional
+            The columns of the results table to select. The columns needed to
+            sort and download the results are always selected. By default,
+            all columns shown in the results table are selected.
+        group_by : list[str], optional
+            If given, select the number and total size of the files in each
+            group of these columns of the results table instead.
+
+        Returns
+        -------
+        str
+            SELECT part of the query.
+        """
+        if group_by is not None:
+            SOARClient._check_columns(group_by, data_table, join=join)
+            names = SOARClient._soar_columns(group_by, join=join)
+            filesize = "h1.filesize" if join else "filesize"
+            return ", ".join([*names, "COUNT(*) AS n_files", f"SUM({filesize}) AS total_size"])
+        if columns is None:
+            names = list(_DEFAULT_COLUMNS)
+            if join:
+                names += _INSTRUMENT_COLUMNS
+            elif data_table == "v_sc_data_item":
+                names.append("sensor")
+        else:
+            SOARClient._check_columns(columns, data_table, join=join)
+            names = [name for name, column in _COLUMN_NAMES.items() if name in _REQUIRED_COLUMNS or column in columns]
+        if join:
+            names = [f"h2.{name}" if name in _INSTRUMENT_COLUMNS else f"h1.{name}" for name in names]
+        return ", ".join(names)
+
+    @staticmethod
+    def _check_columns(columns, data_table, *, join):
+        """
+        Check that the columns of the results table can be selected from a
+        data table.
+
+        Parameters
+        ----------
+        columns : list[str]
+            Columns of the results table.
+        data_table : str
+            Name of the data table.
+        join : bool
+            Whether the data table is joined with an instrument table.
+
+        Raises
+        ------
+        ValueError
+            If a column is not a column of the results table, or is not in the
+            tables queried.
+        """
+        names = SOARClient._soar_columns(columns, join=False)
+        unavailable = [
+            column
+            for column, name in zip(columns, names, strict=True)
+            if (name in _INSTRUMENT_COLUMNS and not join)
+            or (name == "sensor" and (join or data_table != "v_sc_data_item"))
+        ]
+        if unavailable:
+            msg = (
+                f"Columns {unavailable} are not available for queries of {data_table}. Detector and Wavelength "
+                "are only available for remote-sensing instruments, and Sensor for the science data of the others."
+            )
+            raise ValueError(msg)
+
+    @staticmethod
+    def _soar_columns(columns, *, join):
+        """
+        Get the SOAR names of columns of the results table.
+
+        Parameters
+        ----------
+        columns : list[str]
+            Columns of the results table.
+        join : bool
+            Whether the data table is joined with an instrument table.
+
+        Returns
+        -------
+        list[str]
+            The SOAR column names, qualified with the table alias if the data
+            table is joined with an instrument table.
+
+        Raises
+        ------
+        ValueError
+            If a column is not a column of the results table.
+        """
+        soar_names = {column: name for name, column in _COLUMN_NAMES.items()}
+        unknown = set(columns) - soar_names.keys()
+        if unknown:
+            msg = f"Unknown columns {sorted(unknown)}, must be in {list(soar_names)}."
+            raise ValueError(msg)
+        names = [soar_names[column] for column in columns]
+        if join:
+            names = [f"h2.{name}" if name in _INSTRUMENT_COLUMNS else f"h1.{name}" for name in names]
+        return names
 
     @staticmethod
-    def _construct_payload(query):
+    def _construct_payload(query, response_format="json", *, columns=None, group_by=None, page_size=None, after=None):
         """
         Construct search payload.
 
@@ -130,70 +1867,205 @@ class SOARClient(BaseClient):
         ----------
         query : list[str]
             List of query items.
+        response_format : str, optional
+            The format of the response.
+        columns : list[str], optional
+            The columns of the results table to select. By default, all columns
+            shown in the results table are selected.
+        group_by : list[str], optional
+            If given, select the number and total size of the files in each
+            group of these columns of the results table instead of the files.
+        page_size : int, optional
+            If given, only the first ``page_size`` results ordered by start
+            time and data item ID are selected.
+        after : tuple[str, str], optional
+            The start time and data item ID of the last result of the previous
+            page. Only results after it are selected.
 
         Returns
         -------
         dict
             Payload dictionary to be sent with the query.
         """
-        # Default data table
-        data_table = "v_sc_data_item"
-        instrument_table = None
-        query_method = "doQuery"
-        # Mapping is established between the SOAR instrument names and its corresponding SOAR instrument table alias.
-        instrument_mapping = {
-            "SOLOHI": "SHI",
-            "EUI": "EUI",
-            "STIX": "STX",
-            "SPICE": "SPI",
-            "PHI": "PHI",
-            "METIS": "MET",
-        }
+        plan, time_range = _plan_query(query)
+
+        select_part = SOARClient._select_part(plan.data_table, join=plan.join, columns=columns, group_by=group_by)
+        if page_size is not None:
+            select_part = f"TOP {page_size} {select_part}"
+        adql_query_str = f"SELECT {select_part} FROM {plan.from_part} WHERE {plan.where_part(time_range)}"
+        alias = plan.alias
+        if after is not None:
+            begin_time, data_item_id = after
+            adql_query_str += (
+                f" AND ({alias}begin_time>'{begin_time}' OR "
+                f"({alias}begin_time='{begin_time}' AND {alias}data_item_id>'{data_item_id}'))"
+            )
+        if group_by:
+            adql_query_str += f" GROUP BY {', '.join(SOARClient._soar_columns(group_by, join=plan.join))}"
+        if page_size is not None:
+            adql_query_str += f" ORDER BY {alias}begin_time, {alias}data_item_id"
+        if plan.distance is not None and plan.conditions:
+            # The distance filter is a separate parameter, so it has to stay at the end of the query
+            adql_query_str += f"&{plan.distance}"
+        return {"REQUEST": plan.query_method, "LANG": "ADQL", "FORMAT": response_format, "QUERY": adql_query_str}
+
+    def _do_checked_searches(self, queries, **options):
+        """
+        Query the SOAR server with each of ``queries``, after checking that
+        they do not match more than ``max_rows`` files.
+
+        The queries are sent by `_map_queries`, and so are the time windows
+        of the queries which are split, so that no more than ``max_workers``
+        queries are sent at the same time.
+
+        Parameters
+        ----------
+        queries : list[list[str]]
+            The query items of each query.
+        **options
+            Passed to `_construct_payload`, for example the columns to select.
+
+        Returns
+        -------
+        list[list[astropy.table.QTable]]
+            The results of each query, or of each time window of the queries
+            which are split. The results of neighbouring windows can overlap.
+        """
+        if self.max_rows is None or not queries:
+            return [[result] for result in self._map_queries(partial(self._do_search, **options), queries)]
+
+        def check(query):
+            return self._on_max_rows(query, int(self._do_search(query, group_by=[])["Number of files"][0]))
+
+        def search(query_and_action):
+            query, action = query_and_action
+            return [self._do_search(query, use_job=True if action == "jobs" else None, **options)]
 
-        instrument_name = None
-        distance_parameter = []
-        non_distance_parameters = []
-        query_method = "doQuery"
-        instrument_name = None
+        actions = self._map_queries(check, queries)
+        # Files are not spread evenly in time, so the windows are checked and split again if needed
+        windows = [window for action in actions if isinstance(action, list) for window in action]
+        window_results = iter(self._do_checked_searches(windows, **options))
+        unsplit = [(query, action) for query, action in zip(queries, actions, strict=True) if not isinstance(action, list)]
+        unsplit_results = iter(self._map_queries(search, unsplit))
+        return [
+            [result for _ in action for result in next(window_results)]
+            if isinstance(action, list)
+            else next(unsplit_results)
+            for action in actions
+        ]
 
-        for q in query:
-            if "DISTANCE" in str(q):
-                distance_parameter.append(q)
+    async def _do_checked_search_async(self, search, query, **options):
+        """
+        Query the SOAR server with a single query without blocking the event
+        loop, after checking that it does not match more than ``max_rows``
+        files.
+
+        Parameters
+        ----------
+        search : callable
+            Coroutine function sending a query, which takes the same arguments
+            as `_do_search_async` without the session. It limits the number of
+            queries sent at the same time.
+        query : list[str]
+            List of query items.
+        **options
+            Passed to `_construct_payload`, for example the columns to select.
+
+        Returns
+        -------
+        list[astropy.table.QTable]
+            The results of the query, or of each of its time windows if it is
+            split. The results of neighbouring windows can overlap.
+        """
+        if self.max_rows is None:
+            return [await search(query, **options)]
+        n_rows = int((await search(query, group_by=[]))["Number of files"][0])
+        action = self._on_max_rows(query, n_rows)
+        if action == "jobs":
+            return [await search(query, use_job=True, **options)]
+        if action is not None:
+            windows = [self._do_checked_search_async(search, window, **options) for window in action]
+            return [result for results in await asyncio.gather(*windows) for result in results]
+        return [await search(query, **options)]
+
+    def _on_max_rows(self, query, n_rows):
+        """
+        Decide how to run a query matching ``n_rows`` files, according to
+        ``max_rows`` and ``on_max_rows``.
+
+        Parameters
+        ----------
+        query : list[str]
+            List of query items.
+        n_rows : int
+            The number of files the query matches.
+
+        Returns
+        -------
+        list[list[str]] or str or None
+            The query items of the time windows the query is split into,
+            ``"jobs"`` if it is run as an asynchronous job, or `None` if it is
+            run as it is.
+
+        Raises
+        ------
+        RuntimeError
+            If the query matches too many files and ``on_max_rows`` is
+            ``"raise"``.
+        """
+        if n_rows <= self.max_rows:
+            return None
+        msg = f"The query {query} matches {n_rows} files, which is more than max_rows={self.max_rows}."
+        if self.on_max_rows == "raise":
+            msg += " Narrow the query or use SOARClient.iter_search to get the results in pages."
+            raise RuntimeError(msg)
+        if self.on_max_rows == "jobs":
+            log.debug(f"{msg} Running it as an asynchronous job.")
+            return "jobs"
+        if self.on_max_rows == "split":
+            queries = self._split_time_range(query, -(-n_rows // self.max_rows))
+            if queries is not None and query not in queries:
+                log.debug(f"{msg} Splitting it into {len(queries)} time windows.")
+                return queries
+            if queries is None:
+                msg += " It can not be split as it has no time range."
             else:
-                non_distance_parameters.append(q)
-                if q.startswith("instrument") or (q.startswith("descriptor") and not instrument_name):
-                    instrument_name = q.split("=")[1][1:-1].split("-")[0].upper()
-                elif q.startswith("level") and q.split("=")[1][1:3] == "LL":
-                    data_table = "v_ll_data_item"
-
-        query = non_distance_parameters + distance_parameter
-        if distance_parameter:
-            query_method = "doQueryFilteredByDistance"
-        if instrument_name:
-            if instrument_name in instrument_mapping:
-                instrument_name = instrument_mapping[instrument_name]
-            instrument_table = f"v_{instrument_name.lower()}_sc_fits"
-            if data_table == "v_ll_data_item" and instrument_table:
-                instrument_table = instrument_table.replace("_sc_", "_ll_")
-
-        # Need to establish join for remote sensing instruments as they have instrument tables in SOAR.
-        if instrument_name in ["EUI", "MET", "SPI", "PHI", "SHI"]:
-            where_part, from_part, select_part = SOARClient.add_join_to_query(query, data_table, instrument_table)
-        else:
-            from_part = data_table
-            select_part = "*"
-            where_part = " AND ".join(query)
-
-        adql_query = {"SELECT": select_part, "FROM": from_part, "WHERE": where_part}
-        adql_query_str = " ".join([f"{key} {value}" for key, value in adql_query.items()])
-        if query_method == "doQueryFilteredByDistance":
-            adql_query_str = adql_query_str.replace(" AND h1.DISTANCE", "&DISTANCE").replace(
-                " AND DISTANCE", "&DISTANCE"
-            )
-        return {"REQUEST": query_method, "LANG": "ADQL", "FORMAT": "json", "QUERY": adql_query_str}
+                msg += " It can not be split as its time range is too short."
+        warnings.warn(msg, SunpyUserWarning, stacklevel=3)
+        return None
 
     @staticmethod
-    def _do_search(query):
+    def _split_time_range(query, n_windows):
+        """
+        Split the time range of a query into windows of equal length.
+
+        Parameters
+        ----------
+        query : list[str]
+            List of query items.
+        n_windows : int
+            The number of windows.
+
+        Returns
+        -------
+        list[list[str]] or None
+            The query items of the query for each window, or `None` if the
+            query has no time range.
+        """
+        for i, item in enumerate(query):
+            match = _TIME_RANGE.fullmatch(item)
+            if match:
+                break
+        else:
+            return None
+        start, end = parse_time(list(match.groups()))
+        edges = (start + (end - start) * np.linspace(0, 1, n_windows + 1)).strftime("%Y-%m-%d %H:%M:%S")
+        return [
+            [*query[:i], f"begin_time>='{window_start}' AND begin_time<='{window_end}'", *query[i + 1 :]]
+            for window_start, window_end in pairwise(edges)
+        ]
+
+    def _do_search(self, query, *, use_job=None, use_cache=True, **options):
         """
         Query the SOAR server with a single query.
 
@@ -201,61 +2073,291 @@ class SOARClient(BaseClient):
         ----------
         query : list[str]
             List of query items.
+        use_job : bool, optional
+            Whether to run the query as an asynchronous job. Defaults to
+            ``use_jobs``.
+        use_cache : bool, optional
+            Whether to use the cache, if the client has one. Defaults to `True`.
+        **options
+            Passed to `_construct_payload`, for example the columns to select.
 
         Returns
         -------
         astropy.table.QTable
             Query results.
         """
-        tap_endpoint = "http://soar.esac.esa.int/soar-sl-tap/tap"
-        payload = SOARClient._construct_payload(query)
-        # Need to force requests to not form-encode the parameters
-        payload = "&".join([f"{key}={val}" for key, val in payload.items()])
-        # Get request info
-        r = requests.get(f"{tap_endpoint}/sync", params=payload, timeout=60)
-        log.debug(f"Sent query: {r.url}")
-        r.raise_for_status()
+        if self.mirror is not None:
+            with _span(self.metrics, "mirror") as span:
+                result_table = self.mirror.search(query, **options)
+                span["rows"] = len(result_table)
+            return result_table
+        payload = SOARClient._construct_payload(query, self.response_format, **options)
+        if use_cache and self.cache is not None:
+            cached = self.cache.get(payload)
+            if cached is not None:
+                log.debug(f"Using cached result for query: {payload['QUERY']}")
+                _increment(self.metrics, "cache_hits")
+                return cached
+        _increment(self.metrics, "queries")
+        if self.use_jobs if use_job is None else use_job:
+            with _span(self.metrics, "job"):
+                job = self._submit_job(payload)
+                result_table = job.result()
+            # The SOAR keeps finished jobs until it destroys them, so they are deleted once their results are read
+            try:
+                job.delete()
+            except requests.RequestException as err:
+                log.debug(f"Could not delete the SOAR job {job.url}: {err}")
+        else:
+            # Need to force requests to not form-encode the parameters
+            params = "&".join([f"{key}={val}" for key, val in payload.items()])
+            # Get request info
+            with _span(self.metrics, "request") as span:
+                r = self.session.get(f"{_TAP_ENDPOINT}/sync", params=params, timeout=self.timeout, stream=self.stream)
+                # The retries made by urllib3 are recorded on the raw response
+                retries = len(getattr(getattr(r.raw, "retries", None), "history", ()))
+                span.update(status=r.status_code, retries=retries)
+            _increment(self.metrics, "retries", retries)
+            with r:
+                log.debug(f"Sent query: {r.url}")
+                r.raise_for_status()
+                result_table = self._parse_response(r, self.response_format)
+        if use_cache and self.cache is not None:
+            self.cache.set(payload, result_table)
+        return result_table
+
+    async def _do_search_async(self, session, query, *, use_job=None, **options):
+        """
+        Query the SOAR server with a single query without blocking the event
+        loop.
+
+        Parameters
+        ----------
+        session : aiohttp.ClientSession
+            The session used to send the query.
+        query : list[str]
+            List of query items.
+        use_job : bool, optional
+            Whether to run the query as an asynchronous job. Defaults to
+            ``use_jobs``.
+        **options
+            Passed to `_construct_payload`, for example the columns to select.
+
+        Returns
+        -------
+        astropy.table.QTable
+            Query results.
+        """
+        import aiohttp  # NOQA: PLC0415
+        import yarl  # NOQA: PLC0415
+
+        if (self.use_jobs if use_job is None else use_job) or self.mirror is not None:
+            # Waiting for a job to finish blocks, so it is done in a thread
+            return await asyncio.to_thread(partial(self._do_search, query, use_job=use_job, **options))
+        payload = SOARClient._construct_payload(query, self.response_format, **options)
+        if self.cache is not None:
+            cached = self.cache.get(payload)
+            if cached is not None:
+                log.debug(f"Using cached result for query: {payload['QUERY']}")
+                _increment(self.metrics, "cache_hits")
+                return cached
+        params = "&".join([f"{key}={val}" for key, val in payload.items()])
+        # Quote the URL the same way as requests does, and stop aiohttp from quoting it again
+        url = yarl.URL(requests.utils.requote_uri(f"{_TAP_ENDPOINT}/sync?{params}"), encoded=True)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout, sock_read=self.timeout)
+        _increment(self.metrics, "queries")
+        with _span(self.metrics, "request") as span:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    _increment(self.metrics, "retries")
+                    await asyncio.sleep(self.backoff_factor * 2 ** (attempt - 1))
+                try:
+                    r = await session.get(url, timeout=timeout)
+                except aiohttp.ClientConnectionError:
+                    if attempt == self.retries:
+                        raise
+                    continue
+                if r.status not in _RETRY_STATUSES or attempt == self.retries:
+                    break
+                r.release()
+            span.update(status=r.status, retries=attempt)
+        async with r:
+            log.debug(f"Sent query: {r.url}")
+            r.raise_for_status()
+            result_table = await self._parse_response_async(r, self.response_format)
+        if self.cache is not None:
+            self.cache.set(payload, result_table)
+        return result_table
+
+    def _parse_response(self, response, response_format):
+        """
+        Convert a response to a query into a table.
+
+        Parameters
+        ----------
+        response : requests.Response
+            The response to a query.
+        response_format : str
+            The format of the response.
+
+        Returns
+        -------
+        astropy.table.QTable
+            Query results.
+        """
+        try:
+            with _span(self.metrics, "decode", format=response_format):
+                metadata, columns = self._read_response(response, response_format)
+        except ValueError as err:
+            raise _invalid_response_error(response_format) from err
+        return self._build_table(metadata, columns)
+
+    async def _parse_response_async(self, response, response_format):
+        """
+        Convert a response to a query into a table without blocking the event
+        loop while it is downloaded.
 
+        Parameters
+        ----------
+        response : aiohttp.ClientResponse
+            The response to a query.
+        response_format : str
+            The format of the response.
+
+        Returns
+        -------
+        astropy.table.QTable
+            Query results.
+        """
         try:
-            response_json = r.json()
-        except JSONDecodeError as err:
-            msg = "The SOAR server returned an invalid JSON response. It may be down or not functioning correctly."
-            raise RuntimeError(msg) from err
-
-        names = [m["name"] for m in response_json["metadata"]]
-        info = {name: [] for name in names}
-
-        for entry in response_json["data"]:
-            for i, name in enumerate(names):
-                info[name].append(entry[i])
-
-        if len(info["begin_time"]):
-            info["begin_time"] = parse_time(info["begin_time"]).iso
-            info["end_time"] = parse_time(info["end_time"]).iso
-
-        result_table = astropy.table.QTable(
-            {
-                "Instrument": info["instrument"],
-                "Data product": info["descriptor"],
-                "Level": info["level"],
-                "Start time": info["begin_time"],
-                "End time": info["end_time"],
-                "Data item ID": info["data_item_id"],
-                "Filename": info["filename"],
-                "Filesize": info["filesize"],
-                "SOOP Name": info["soop_name"],
-            },
-        )
-        if "detector" in info:
-            result_table["Detector"] = info["detector"]
-        if "sensor" in info:
-            result_table["Sensor"] = info["sensor"]
-        if "wavelength" in info:
-            result_table["Wavelength"] = info["wavelength"]
-        result_table.sort("Start time")
+            with _span(self.metrics, "decode", format=response_format) as span:
+                if self.stream and response_format == "json":
+                    parser = _TAPJSONStreamParser()
+                    n_bytes = 0
+                    async for chunk in response.content.iter_chunked(2**20):
+                        n_bytes += len(chunk)
+                        parser.feed(chunk)
+                    metadata, columns = parser.close()
+                else:
+                    content = await response.read()
+                    n_bytes = len(content)
+                    metadata, columns = self._read_content(content, response_format)
+                span["bytes"] = n_bytes
+            _increment(self.metrics, "bytes_received", n_bytes)
+        except ValueError as err:
+            raise _invalid_response_error(response_format) from err
+        return self._build_table(metadata, columns)
+
+    def _build_table(self, metadata, columns):
+        """
+        Build the results table of a query from the columns of its response.
+
+        Parameters
+        ----------
+        metadata : list[dict]
+            The column descriptions from the response.
+        columns : list[sequence]
+            The values of each column.
+
+        Returns
+        -------
+        astropy.table.QTable
+            Query results, sorted by start time.
+        """
+        with _span(self.metrics, "table") as span:
+            result_table = _table_from_columns(metadata, columns, metrics=self.metrics)
+            if "Start time" in result_table.colnames:
+                result_table.sort("Start time")
+            span["rows"] = len(result_table)
+        _increment(self.metrics, "rows_parsed", len(result_table))
         return result_table
 
-    def fetch(self, query_results, *, path, downloader, **kwargs) -> None:
+    def _read_response(self, response, response_format):
+        """
+        Read the columns of a TAP response.
+
+        Parameters
+        ----------
+        response : requests.Response
+            The response to a query.
+        response_format : str
+            The format of the response.
+
+        Returns
+        -------
+        tuple[list[dict], list[sequence]]
+            The column descriptions and the values of each column.
+
+        Raises
+        ------
+        ValueError
+            If the response can not be read.
+        """
+        if self.stream and response_format == "json":
+            parser = _TAPJSONStreamParser()
+            n_bytes = 0
+            for chunk in response.iter_content(chunk_size=2**20):
+                n_bytes += len(chunk)
+                parser.feed(chunk)
+            _increment(self.metrics, "bytes_received", n_bytes)
+            return parser.close()
+        _increment(self.metrics, "bytes_received", len(response.content))
+        return self._read_content(response.content, response_format)
+
+    @staticmethod
+    def _read_content(content, response_format):
+        """
+        Read the columns of the body of a TAP response.
+
+        Parameters
+        ----------
+        content : bytes
+            The body of the response.
+        response_format : str
+            The format of the response.
+
+        Returns
+        -------
+        tuple[list[dict], list[sequence]]
+            The column descriptions and the values of each column.
+
+        Raises
+        ------
+        ValueError
+            If the response can not be read.
+        """
+        if response_format == "csv":
+            # The types of the columns can not be inferred from their values, e.g. when they are all empty
+            table = astropy.io.ascii.read(
+                content.decode().splitlines(), format="csv", converters={"*": [astropy.io.ascii.convert_numpy(str)]}
+            )
+            return _columns_from_table(table, datatypes=_COLUMN_DATATYPES)
+        if response_format == "votable":
+            try:
+                votable = astropy.io.votable.parse_single_table(io.BytesIO(content))
+            except IndexError as err:
+                msg = "Response does not contain a table"
+                raise ValueError(msg) from err
+            return _columns_from_table(votable.to_table())
+        response_json = json.loads(content)
+        metadata = response_json["metadata"]
+        # Transpose the rows into one sequence of values per column
+        columns = list(zip(*response_json["data"], strict=True)) or [()] * len(metadata)
+        return metadata, columns
+
+    @u.quantity_input(split_size=u.byte)
+    def fetch(
+        self,
+        query_results,
+        *,
+        path,
+        downloader,
+        largest_first=True,
+        split_size=100 * u.Mbyte,
+        max_splits=5,
+        checksum=False,
+        **kwargs,
+    ):
         """
         Queue a set of results to be downloaded.
         `sunpy.net.base_client.BaseClient` does the actual downloading, so we
@@ -270,22 +2372,119 @@ class SOARClient(BaseClient):
             field for the filename.
         downloader : parfive.Downloader
             Downloader instance used to download data.
+        largest_first : bool, optional
+            If `True`, the largest files are queued first, so that the download
+            does not end waiting for a single large file. Defaults to `True`.
+        split_size : `~astropy.units.Quantity`, optional
+            Files larger than this are downloaded in up to ``max_splits`` parts
+            at the same time. Smaller files are downloaded in one part, as
+            splitting them only adds requests. Defaults to 100 Mbyte.
+        max_splits : int, optional
+            The maximum number of parts large files are downloaded in.
+            Defaults to 5.
+        checksum : bool, optional
+            If `True`, existing and downloaded files are checked against the
+            checksum sent by the SOAR, if it sends one. This needs a version of
+            parfive whose ``Downloader.enqueue_file`` accepts ``checksum``.
+            Defaults to `False`.
         kwargs :
-            Keyword arguments aren't used by this client.
+            Other keyword arguments aren't used by this client.
+
+        Returns
+        -------
+        parfive.Results
+            The files which already exist and are not downloaded again.
+
+        Notes
+        -----
+        Unless the ``downloader`` overwrites files, files which already exist
+        with the size given in the results are not downloaded again, without
+        contacting the SOAR. Existing files with a different size, for example
+        from an interrupted download, are downloaded again.
         """
+        import parfive  # NOQA: PLC0415
+
         base_url = "http://soar.esac.esa.int/soar-sl-tap/data?" "retrieval_type=LAST_PRODUCT"
 
-        for row in query_results:
-            url = base_url
-            if row["Level"].startswith("LL"):
-                url += "&product_type=LOW_LATENCY"
-            else:
-                url += "&product_type=SCIENCE"
-            data_id = row["Data item ID"]
-            url += f"&data_item_id={data_id}"
-            filepath = str(path).format(file=row["Filename"], **row.response_block_map)
-            log.debug(f"Queuing URL: {url}")
-            downloader.enqueue_file(url, filename=filepath)
+        existing = parfive.Results()
+        queued = set()
+        n_queued = 0
+        has_filesize = "Filesize" in getattr(query_results, "colnames", ())
+        check_existing = has_filesize and not getattr(getattr(downloader, "config", None), "overwrite", False)
+        with _span(self.metrics, "fetch") as span:
+            if largest_first and has_filesize:
+                query_results = query_results[np.argsort(query_results["Filesize"], kind="stable")[::-1]]
+            for row in query_results:
+                url = base_url
+                if row["Level"].startswith("LL"):
+                    url += "&product_type=LOW_LATENCY"
+                else:
+                    url += "&product_type=SCIENCE"
+                data_id = row["Data item ID"]
+                if data_id in queued:
+                    continue
+                queued.add(data_id)
+                url += f"&data_item_id={data_id}"
+                filepath = str(path).format(file=row["Filename"], **row.response_block_map)
+                overwrite = None
+                if check_existing and (size := _file_size(filepath)) is not None:
+                    # The sizes in the results are rounded to the nearest kbyte
+                    if abs(size - row["Filesize"]) <= 0.5 * u.kbyte:
+                        if not checksum:
+                            log.debug(f"Skipping existing file: {filepath}")
+                            existing.append(path=filepath, url=url)
+                            continue
+                    else:
+                        log.debug(f"Downloading incomplete file again: {filepath}")
+                        overwrite = True
+                splits = max_splits if has_filesize and row["Filesize"] > split_size else 1
+                log.debug(f"Queuing URL: {url}")
+                # Older versions of parfive pass unknown arguments on to aiohttp, so checksum is only given if needed
+                options = {"checksum": True} if checksum else {}
+                downloader.enqueue_file(url, filename=filepath, max_splits=splits, overwrite=overwrite, **options)
+                n_queued += 1
+            span.update(queued=n_queued, skipped=len(existing))
+        _increment(self.metrics, "files_queued", n_queued)
+        _increment(self.metrics, "files_skipped", len(existing))
+        return existing
+
+    async def fetch_async(self, query_results, *, path=None, downloader=None, **kwargs):
+        """
+        Download a set of results without blocking the event loop.
+
+        Parameters
+        ----------
+        query_results : sunpy.net.base_client.QueryResponseTable
+            Results from a search.
+        path : str or `pathlib.Path`, optional
+            Path to download files to. Can be a format string with a ``file``
+            field for the filename, otherwise it is the directory files are
+            downloaded to. Defaults to the sunpy download directory.
+        downloader : parfive.Downloader, optional
+            Downloader instance used to download data. If not given, a
+            downloader without a progress bar is created, which downloads
+            at most 5 files at the same time.
+        kwargs :
+            Passed to `~sunpy_soar.SOARClient.fetch`.
+
+        Returns
+        -------
+        parfive.Results
+            The paths of the downloaded files and any errors.
+        """
+        import parfive  # NOQA: PLC0415
+
+        if path is None:
+            path = pathlib.Path(config.get("downloads", "download_dir")) / "{file}"
+        elif "{file}" not in str(path):
+            path = pathlib.Path(path) / "{file}"
+        path = pathlib.Path(path).expanduser()
+        if downloader is None:
+            downloader = parfive.Downloader(max_conn=_DOWNLOAD_MAX_CONNECTIONS, progress=False)
+        existing = self.fetch(query_results, path=path, downloader=downloader, **kwargs)
+        results = await downloader.run_download()
+        results.data += existing.data
+        return results
 
     @classmethod
     def _can_handle_query(cls, *query) -> bool:
@@ -318,7 +2517,7 @@ class SOARClient(BaseClient):
             return False
         # check to make sure the instrument attr passed is one provided by the SOAR.
         # also check to make sure that the provider passed is the SOAR for which this client can handle.
-        instr = [i[0].lower() for i in cls.register_values()[a.Instrument]]
+        instr = _instrument_names()
         for x in query:
             if isinstance(x, a.Instrument) and str(x.value).lower() not in instr:
                 return False
@@ -348,42 +2547,11 @@ class SOARClient(BaseClient):
         """
         Loads the net attribute values from the JSON file.
 
+        The JSON files are only read the first time this is called.
+
         Returns
         -------
         dict
             The dictionary containing the values formed into attributes.
         """
-        from sunpy_soar.attrs import SOOP, Product, Sensor  # NOQA: PLC0415
-
-        # Instrument attrs
-        attrs_path = pathlib.Path(__file__).parent / "data" / "attrs.json"
-        with attrs_path.open() as attrs_file:
-            all_datasets = json.load(attrs_file)
-        # Convert from dict to list of tuples
-        all_datasets = list(all_datasets.items())
-
-        # Instrument attrs
-        instr_path = pathlib.Path(__file__).parent / "data" / "instrument_attrs.json"
-        with instr_path.open() as instr_attrs_file:
-            all_instr = json.load(instr_attrs_file)
-        all_instr = list(all_instr.items())
-
-        # Sensor attrs
-        sensor_path = pathlib.Path(__file__).parent / "data" / "sensor_attrs.json"
-        with sensor_path.open() as sensor_attrs_file:
-            all_sensors = json.load(sensor_attrs_file)
-        all_sensors = list(all_sensors.items())
-
-        soop_path = pathlib.Path(__file__).parent / "data" / "soop_attrs.json"
-        with soop_path.open() as soop_path_file:
-            all_soops = json.load(soop_path_file)
-
-        all_soops = list(all_soops.items())
-
-        return {
-            Product: all_datasets,
-            a.Instrument: all_instr,
-            Sensor: all_sensors,
-            SOOP: all_soops,
-            a.Provider: [("SOAR", "Solar Orbiter Archive.")],
-        }
+        return {attr: list(values) for attr, values in _dataset_values().items()}
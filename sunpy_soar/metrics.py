@@ -0,0 +1,194 @@
+"""
+This file defines the SOARMetrics class, which records how long each phase of
+the searches and downloads of a SOARClient takes.
+"""
+
+import contextlib
+import threading
+import time
+
+__all__ = ["SOARMetrics"]
+
+# The counters recorded by SOARClient, and their descriptions used as the HELP text of the Prometheus metrics.
+_COUNTERS = {
+    "queries": "Queries sent to the SOAR.",
+    "retries": "Queries retried after a connection or server error.",
+    "cache_hits": "Queries answered from the query cache.",
+    "bytes_received": "Bytes of the responses to queries.",
+    "rows_parsed": "Rows of the responses to queries.",
+    "files_queued": "Files queued for download.",
+    "files_skipped": "Files not queued for download as they already exist.",
+}
+
+
+class SOARMetrics:
+    """
+    Records how long each phase of the searches and downloads of a
+    `~sunpy_soar.SOARClient` takes, and counts the queries, retries, bytes
+    and rows of its responses.
+
+    Pass it to ``SOARClient(metrics=...)``, or set ``SOARClient.metrics`` to
+    record the searches made by ``Fido``, which creates its own client.
+    The recorded metrics can be exported with `to_prometheus`.
+
+    Parameters
+    ----------
+    callbacks : list[callable], optional
+        Functions called with ``(phase, duration, attributes)`` at the end of
+        each phase, where ``duration`` is in seconds and ``attributes`` is a
+        dictionary describing the phase, for example the number of rows
+        parsed. They can be used to forward the phases to a tracing system.
+        They are called from the thread running the phase.
+
+    Notes
+    -----
+    The phases recorded are:
+
+    * ``search``: a whole search, from walking the query to merging the results.
+    * ``walk``: converting the query into the query items of each sub-query.
+    * ``request``: sending a query and waiting for the response, including
+      downloading it unless the client streams responses.
+    * ``decode``: reading the columns of a response, including downloading it
+      when the client streams responses.
+    * ``parse_time``: converting the start and end times of the results.
+    * ``table``: building the results table of a query from its columns.
+    * ``merge``: combining the results of the sub-queries of a search.
+    * ``job``: running a query as an asynchronous job on the SOAR.
+    * ``mirror``: answering a query from a `~sunpy_soar.SOARMirror`.
+    * ``fetch``: queuing the files of search results for download.
+    """
+
+    def __init__(self, callbacks=()) -> None:
+        self.callbacks = list(callbacks)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.counters}>"
+
+    def reset(self):
+        """
+        Forget all recorded metrics.
+        """
+        with self._lock:
+            self._durations = {}
+            self._counters = {}
+
+    @property
+    def durations(self):
+        """
+        The number of times each phase ran, and the total number of seconds it
+        took, as a dictionary of ``(count, seconds)`` tuples.
+        """
+        with self._lock:
+            return {phase: tuple(value) for phase, value in self._durations.items()}
+
+    @property
+    def counters(self):
+        """
+        The value of each counter, as a dictionary.
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    @contextlib.contextmanager
+    def span(self, phase, **attributes):
+        """
+        Time a phase.
+
+        Parameters
+        ----------
+        phase : str
+            The name of the phase.
+        **attributes
+            Describe the phase.
+
+        Yields
+        ------
+        dict
+            The attributes of the phase, which can be added to while it runs.
+        """
+        start = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                count, total = self._durations.get(phase, (0, 0.0))
+                self._durations[phase] = [count + 1, total + duration]
+            for callback in self.callbacks:
+                callback(phase, duration, attributes)
+
+    def increment(self, name, value=1):
+        """
+        Add to a counter.
+
+        Parameters
+        ----------
+        name : str
+            The name of the counter.
+        value : int, optional
+            The amount added. Defaults to 1.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def to_prometheus(self, prefix="sunpy_soar"):
+        """
+        Export the recorded metrics in the Prometheus text format.
+
+        The durations are exported as a summary labelled by phase, and each
+        counter as a counter. The text can be served to Prometheus, written
+        to a file read by the node exporter textfile collector, or sent to a
+        Pushgateway.
+
+        Parameters
+        ----------
+        prefix : str, optional
+            The prefix of the metric names. Defaults to "sunpy_soar".
+
+        Returns
+        -------
+        str
+        """
+        durations = self.durations
+        counters = self.counters
+        lines = []
+        if durations:
+            name = f"{prefix}_phase_seconds"
+            lines += [
+                f"# HELP {name} Time spent in each phase of SOARClient searches and downloads.",
+                f"# TYPE {name} summary",
+            ]
+            for phase, (count, total) in sorted(durations.items()):
+                lines += [f'{name}_sum{{phase="{phase}"}} {total!r}', f'{name}_count{{phase="{phase}"}} {count}']
+        for counter, value in sorted(counters.items()):
+            name = f"{prefix}_{counter}_total"
+            lines += [
+                f"# HELP {name} {_COUNTERS.get(counter, counter)}",
+                f"# TYPE {name} counter",
+                f"{name} {value}",
+            ]
+        return "".join(f"{line}\n" for line in lines)
+
+
+def _span(metrics, phase, **attributes):
+    """
+    Time a phase if ``metrics`` is not `None`.
+
+    Returns
+    -------
+    context manager
+        Yields the attributes of the phase.
+    """
+    if metrics is None:
+        return contextlib.nullcontext(attributes)
+    return metrics.span(phase, **attributes)
+
+
+def _increment(metrics, name, value=1):
+    """
+    Add to a counter if ``metrics`` is not `None`.
+    """
+    if metrics is not None:
+        metrics.increment(name, value)
@@ -0,0 +1,228 @@
+"""
+This file defines the SOARMirror class, which keeps a local copy of the SOAR
+metadata that can be searched without contacting the SOAR.
+"""
+
+import contextlib
+import pathlib
+import re
+import sqlite3
+
+import numpy as np
+from sunpy import config, log
+
+from sunpy_soar.client import (_COLUMN_DATATYPES, _COLUMN_NAMES,
+                               _DEFAULT_COLUMNS, _INSTRUMENT_COLUMNS,
+                               _REQUIRED_COLUMNS, _TIME_RANGE, SOARClient,
+                               _table_from_columns)
+
+__all__ = ["SOARMirror"]
+
+# The SQLite type of each column, columns not listed here are text.
+_COLUMN_TYPES = {"filesize": "INTEGER", "wavelength": "REAL"}
+# Columns which only some instruments have values for.
+_OPTIONAL_COLUMNS = ("sensor", *_INSTRUMENT_COLUMNS)
+_INDEXED_COLUMNS = ("begin_time", "instrument", "descriptor", "level", "soop_name")
+_WAVELENGTH_RANGE = re.compile(r"Wavemin='([^']*)' AND Wavemax='([^']*)'")
+
+
+def _time_bounds(start, end):
+    """
+    Round the bounds of a time range to the milliseconds of the copied start
+    times, which are compared as text.
+
+    Parameters
+    ----------
+    start, end : str
+        The bounds of the time range.
+
+    Returns
+    -------
+    tuple[str, str]
+        The earliest and latest start times in milliseconds within the range.
+    """
+    try:
+        times = np.array([start, end], dtype="datetime64[ns]")
+    except ValueError:
+        # numpy can not parse everything astropy can, e.g. leap seconds
+        return start, end
+    times = [(times[0] + np.timedelta64(999_999, "ns")).astype("datetime64[ms]"), times[1].astype("datetime64[ms]")]
+    start, end = np.char.replace(np.datetime_as_string(times, unit="ms"), "T", " ")
+    return str(start), str(end)
+
+
+class SOARMirror:
+    """
+    A local copy of the SOAR metadata, stored in an SQLite database.
+
+    The metadata of the files matching a query are copied from the SOAR with
+    `sync`. A `~sunpy_soar.SOARClient` created with ``mirror=`` then answers
+    searches from this copy instead of the SOAR, so they are much faster and
+    work when the SOAR can not be reached. Only files which were copied are
+    found. Searches by distance or by a range of wavelengths can not be
+    answered, as the columns they need are not copied.
+
+    Parameters
+    ----------
+    path : str or `pathlib.Path`, optional
+        The SQLite database file. Defaults to ``soar_mirror.sqlite`` inside
+        the sunpy working directory.
+    """
+
+    def __init__(self, path=None) -> None:
+        if path is None:
+            path = pathlib.Path(config.get("general", "working_dir")) / "soar_mirror.sqlite"
+        self.path = pathlib.Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            columns = ", ".join(
+                f"{name} {_COLUMN_TYPES.get(name, 'TEXT')}{' PRIMARY KEY' if name == 'data_item_id' else ''}"
+                for name in _COLUMN_NAMES
+            )
+            connection.execute(f"CREATE TABLE IF NOT EXISTS data_item ({columns})")
+            for name in _INDEXED_COLUMNS:
+                connection.execute(f"CREATE INDEX IF NOT EXISTS data_item_{name} ON data_item ({name})")
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.path}>"
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # A new connection is used for each operation, as SQLite connections
+        # can not be shared between the threads searches are run in.
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def sync(self, *query, client=None, page_size=10_000):
+        """
+        Copy the metadata of the files matching a query from the SOAR.
+
+        Files which were copied before are updated. The detector and
+        wavelength of files from remote-sensing instruments are only copied
+        if the query includes the instrument.
+
+        Parameters
+        ----------
+        *query : `tuple`
+            `sunpy.net.attrs` objects representing the query.
+        client : `~sunpy_soar.SOARClient`, optional
+            The client used to query the SOAR.
+        page_size : int, optional
+            The number of files requested from the SOAR at a time.
+            Defaults to 10000.
+
+        Returns
+        -------
+        int
+            The number of files copied.
+        """
+        client = SOARClient() if client is None else client
+        soar_names = {column: name for name, column in _COLUMN_NAMES.items()}
+        n_rows = 0
+        for table in client._iter_pages(query, page_size=page_size):
+            rows = zip(*[table[column].tolist() for column in table.colnames], strict=True)
+            columns = [soar_names[column] for column in table.colnames]
+            # Keep the values of optional columns which are not selected by this query
+            updates = ", ".join(
+                f"{name}=COALESCE(excluded.{name}, {name})" if name in _OPTIONAL_COLUMNS else f"{name}=excluded.{name}"
+                for name in columns
+                if name != "data_item_id"
+            )
+            with self._connect() as connection:
+                connection.executemany(
+                    f"INSERT INTO data_item ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                    f"ON CONFLICT (data_item_id) DO UPDATE SET {updates}",
+                    rows,
+                )
+            n_rows += len(table)
+        log.debug(f"Copied {n_rows} files to {self}")
+        return n_rows
+
+    def search(self, query, *, columns=None, group_by=None, page_size=None, after=None):
+        """
+        Search the copied metadata with a single query.
+
+        This takes the same arguments as ``SOARClient._construct_payload``
+        and returns the same table as a query to the SOAR.
+
+        Parameters
+        ----------
+        query : list[str]
+            List of query items.
+        columns : list[str], optional
+            The columns of the results table to select.
+        group_by : list[str], optional
+            If given, select the number and total size of the files in each
+            group of these columns of the results table instead of the files.
+        page_size : int, optional
+            If given, only return the first ``page_size`` results.
+        after : tuple[str, str], optional
+            The start time and data item ID of the last result of the previous
+            page.
+
+        Returns
+        -------
+        astropy.table.QTable
+            Query results.
+        """
+        conditions = []
+        for item in query:
+            if item.startswith("DISTANCE"):
+                msg = "Searches by distance can not be answered by a SOARMirror."
+                raise ValueError(msg)
+            match = _TIME_RANGE.fullmatch(item)
+            if match:
+                start, end = _time_bounds(*match.groups())
+                conditions.append(f"begin_time>='{start}' AND begin_time<='{end}'")
+                continue
+            wavelength = _WAVELENGTH_RANGE.search(item)
+            if wavelength:
+                # The wavelength range of the instrument tables is not copied, only the wavelength
+                wavemin, wavemax = wavelength.groups()
+                if float(wavemin) != float(wavemax):
+                    msg = "Searches by wavelength range can not be answered by a SOARMirror, only by one wavelength."
+                    raise ValueError(msg)
+                item = _WAVELENGTH_RANGE.sub(r"wavelength=\1", item)
+            conditions.append(item)
+        if after is not None:
+            conditions.append("(begin_time>? OR (begin_time=? AND data_item_id>?))")
+        sql_params = [after[0], *after] if after is not None else []
+
+        if group_by is not None:
+            names = SOARClient._soar_columns(group_by, join=False)
+            select = [*names, "COUNT(*) AS n_files", "SUM(filesize) AS total_size"]
+            names += ["n_files", "total_size"]
+        elif columns is None:
+            names = [*_DEFAULT_COLUMNS, *_OPTIONAL_COLUMNS]
+            select = names
+        else:
+            SOARClient._soar_columns(columns, join=False)
+            names = [name for name, column in _COLUMN_NAMES.items() if name in _REQUIRED_COLUMNS or column in columns]
+            select = names
+
+        sql = f"SELECT {', '.join(select)} FROM data_item"
+        if conditions:
+            sql += f" WHERE {' AND '.join(conditions)}"
+        if group_by:
+            sql += f" GROUP BY {', '.join(names[:-2])}"
+        if group_by is None:
+            sql += " ORDER BY begin_time, data_item_id"
+        if page_size is not None:
+            sql += f" LIMIT {int(page_size)}"
+        with self._connect() as connection:
+            rows = connection.execute(sql, sql_params).fetchall()
+
+        values = list(zip(*rows, strict=True)) or [()] * len(names)
+        if group_by is None and columns is None:
+            # Like the SOAR, only return the optional columns of instruments which have them
+            present = [
+                i for i, name in enumerate(names) if name not in _OPTIONAL_COLUMNS or any(v is not None for v in values[i])
+            ]
+            names = [names[i] for i in present]
+            values = [values[i] for i in present]
+        metadata = [{"name": name, "datatype": _COLUMN_DATATYPES.get(name, "char")} for name in names]
+        return _table_from_columns(metadata, values)
@@ -1,15 +1,39 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
 from pathlib import Path
+from urllib.parse import unquote
 
+import aiohttp
 import astropy.units as u
+import parfive
 import pytest
+import requests
 import responses
 import sunpy.map
+from aiohttp import web
+from astropy.io.votable import from_table
+from astropy.table import QTable
 from requests.exceptions import HTTPError
+from responses.registries import OrderedRegistry
 from sunpy.net import Fido
 from sunpy.net import attrs as a
-from sunpy.util.exceptions import SunpyUserWarning
+from sunpy.time import parse_time
+from sunpy.util.exceptions import SunpyDeprecationWarning, SunpyUserWarning
 
-from sunpy_soar.client import SOARClient
+from sunpy_soar.client import (SOARClient, SOARQueryCache, SOARSyncState,
+                               SOARTapJob, _iso_times, _merge_queries,
+                               _query_plan, _table_from_columns,
+                               _TAPJSONStreamParser)
+from sunpy_soar.metrics import SOARMetrics
+from sunpy_soar.mirror import SOARMirror
 
 SUNPY_VERSION = (sunpy.version.major, sunpy.version.minor)
 
@@ -119,6 +143,23 @@ def test_registered_soop_names() -> None:
     assert "\nr_small_mres_mcad_ar_long_term" in soop_attr
 
 
+def test_dataset_values_loaded_once(monkeypatch) -> None:
+    SOARClient.load_dataset_values()
+
+    def fail_open(*args, **kwargs):
+        msg = "The attr values were read again"
+        raise AssertionError(msg)
+
+    monkeypatch.setattr(Path, "open", fail_open)
+    values = SOARClient.register_values()
+    assert ("STIX", "Spectrometer Telescope for Imaging X-rays") in values[a.Instrument]
+    # Changing the returned values does not change the registered values
+    values[a.Instrument].clear()
+    assert SOARClient.register_values()[a.Instrument]
+    assert SOARClient._can_handle_query(a.Time("2022-01-01", "2022-01-02"), a.Instrument("stix"))
+    assert not SOARClient._can_handle_query(a.Time("2022-01-01", "2022-01-02"), a.Instrument("AIA"))
+
+
 def test_search_soop() -> None:
     instrument = a.Instrument("EUI")
     time = a.Time("2022-04-01 01:00", "2022-04-01 02:00")
@@ -256,8 +297,8 @@ def test_join_science_query() -> None:
 
     assert result["QUERY"] == (
         "SELECT h1.instrument, h1.descriptor, h1.level, h1.begin_time, h1.end_time, "
-        "h1.data_item_id, h1.filesize, h1.filename, h1.soop_name, h2.detector, h2.wavelength, "
-        "h2.dimension_index FROM v_sc_data_item AS h1 JOIN v_eui_sc_fits AS h2 USING (data_item_oid)"
+        "h1.data_item_id, h1.filesize, h1.filename, h1.soop_name, h2.detector, h2.wavelength"
+        " FROM v_sc_data_item AS h1 JOIN v_eui_sc_fits AS h2 USING (data_item_oid)"
         " WHERE h1.instrument='EUI' AND h1.begin_time>='2021-02-01 00:00:00' AND h1.begin_time<='2021-02-02 00:00:00'"
         " AND h2.dimension_index='1' AND h1.level='L1' AND h1.descriptor='eui-fsi174-image'"
     )
@@ -275,8 +316,8 @@ def test_join_low_latency_query() -> None:
 
     assert result["QUERY"] == (
         "SELECT h1.instrument, h1.descriptor, h1.level, h1.begin_time, h1.end_time, "
-        "h1.data_item_id, h1.filesize, h1.filename, h1.soop_name, h2.detector, h2.wavelength, "
-        "h2.dimension_index FROM v_ll_data_item AS h1 JOIN v_eui_ll_fits AS h2 USING (data_item_oid)"
+        "h1.data_item_id, h1.filesize, h1.filename, h1.soop_name, h2.detector, h2.wavelength"
+        " FROM v_ll_data_item AS h1 JOIN v_eui_ll_fits AS h2 USING (data_item_oid)"
         " WHERE h1.instrument='EUI' AND h1.begin_time>='2021-02-01 00:00:00' AND h1.begin_time<='2021-02-02 00:00:00'"
         " AND h2.dimension_index='1' AND h1.level='LL01' AND h1.descriptor='eui-fsi174-image'"
     )
@@ -291,7 +332,10 @@ def test_distance_query():
         ]
     )
 
-    assert result["QUERY"] == ("SELECT * FROM v_sc_data_item WHERE instrument='RPW' AND level='L2'&DISTANCE(0.28,0.30)")
+    assert result["QUERY"] == (
+        "SELECT instrument, descriptor, level, begin_time, end_time, data_item_id, filesize, filename, soop_name, "
+        "sensor FROM v_sc_data_item WHERE instrument='RPW' AND level='L2'&DISTANCE(0.28,0.30)"
+    )
 
 
 def test_distance_join_query():
@@ -306,12 +350,131 @@ def test_distance_join_query():
 
     assert result["QUERY"] == (
         "SELECT h1.instrument, h1.descriptor, h1.level, h1.begin_time, h1.end_time, "
-        "h1.data_item_id, h1.filesize, h1.filename, h1.soop_name, h2.detector, h2.wavelength, "
-        "h2.dimension_index FROM v_sc_data_item AS h1 JOIN v_eui_sc_fits AS h2 USING (data_item_oid)"
+        "h1.data_item_id, h1.filesize, h1.filename, h1.soop_name, h2.detector, h2.wavelength"
+        " FROM v_sc_data_item AS h1 JOIN v_eui_sc_fits AS h2 USING (data_item_oid)"
         " WHERE h1.instrument='EUI' AND h1.level='L2' AND h1.descriptor='eui-fsi174-image'&DISTANCE(0.28,0.30)"
     )
 
 
+def test_query_plan() -> None:
+    plan = _query_plan((None, "instrument='EUI'", "level='LL01'", "Wavemin='17.0' AND Wavemax='30.4'"))
+    assert plan.query_method == "doQuery"
+    assert plan.data_table == "v_ll_data_item"
+    assert plan.instrument_table == "v_eui_ll_fits"
+    assert plan.conditions == (None, "h1.instrument='EUI'", "h1.level='LL01'", "h2.Wavemin='17.0' AND h2.Wavemax='30.4'")
+    assert plan.where_part(("2022-01-01", "2022-01-02")).startswith(
+        "h1.begin_time>='2022-01-01' AND h1.begin_time<='2022-01-02' AND h2.dimension_index='1' AND "
+    )
+
+    plan = _query_plan(("descriptor='mag-rtn-normal'", "DISTANCE(0.28,0.30)"))
+    assert plan.query_method == "doQueryFilteredByDistance"
+    assert not plan.join
+    assert plan.conditions == ("descriptor='mag-rtn-normal'",)
+    assert plan.distance == "DISTANCE(0.28,0.30)"
+
+
+def test_query_plan_reused_for_time_windows() -> None:
+    client = SOARClient(time_window=1 * u.day)
+    queries = client._walk((a.Time("2022-01-01", "2022-01-05"), a.Instrument("SPICE"), a.Level(2)))
+    _query_plan.cache_clear()
+    payloads = [client._construct_payload(query)["QUERY"] for query in queries]
+    assert _query_plan.cache_info().misses == 1
+    assert _query_plan.cache_info().hits == 3
+    assert len(set(payloads)) == 4
+    assert "h1.begin_time>='2022-01-03 00:00:00' AND h1.begin_time<='2022-01-04 00:00:00'" in payloads[2]
+
+
+def test_merge_queries() -> None:
+    time = "begin_time>='2022-01-01 00:00:00' AND begin_time<='2022-01-02 00:00:00'"
+    queries = [
+        [time, "descriptor='eui-fsi174-image'", "level='L2'"],
+        [time, "descriptor='eui-fsi304-image'", "level='L2'"],
+        [time, "descriptor='eui-fsi174-image'", "level='L2'"],
+        [time, "descriptor='eui-fsi174-image'", "level='L1'"],
+        [time, "descriptor='eui-fsi304-image'", "level='L1'"],
+    ]
+    assert _merge_queries(queries) == [
+        [time, "descriptor IN ('eui-fsi174-image', 'eui-fsi304-image')", "level IN ('L2', 'L1')"]
+    ]
+
+    # Instruments which are joined with different tables, or levels in different tables, are not merged
+    queries = [[time, "instrument='EUI'"], [time, "instrument='MAG'"], [time, "instrument='SWA'"]]
+    assert _merge_queries(queries) == [[time, "instrument='EUI'"], [time, "instrument IN ('MAG', 'SWA')"]]
+    queries = [[time, "instrument='MAG'", "level='L2'"], [time, "instrument='MAG'", "level='LL02'"]]
+    assert _merge_queries(queries) == queries
+
+
+@responses.activate
+def test_search_merges_products() -> None:
+    responses.add(
+        responses.GET,
+        re.compile(f"{TAP_SYNC_URL}.*"),
+        json=_tap_json(
+            [
+                _tap_row("EUI", "eui-fsi174-image", "2022-04-01 00:00:00"),
+                _tap_row("EUI", "eui-fsi304-image", "2022-04-01 00:10:00"),
+            ]
+        ),
+    )
+    products = a.soar.Product("eui-fsi174-image") | a.soar.Product("eui-fsi304-image") | a.soar.Product("eui-fsi174-image")
+    res = SOARClient().search(a.Time("2022-04-01", "2022-04-02"), a.Level(2), products)
+    assert len(responses.calls) == 1
+    query = unquote(responses.calls[0].request.url).replace("+", " ")
+    assert "JOIN v_eui_sc_fits AS h2" in query
+    assert "h1.descriptor IN ('eui-fsi174-image', 'eui-fsi304-image')" in query
+    assert list(res["Data product"]) == ["eui-fsi174-image", "eui-fsi304-image"]
+
+
+@pytest.mark.parametrize(
+    ("query", "tables"),
+    [
+        (["instrument='EUI'", "begin_time>='2022-02-11 00:00:00' AND begin_time<='2022-02-12 00:00:00'"], "v_eui_sc_fits"),
+        (["instrument='MAG'", "level='L2'"], None),
+    ],
+)
+def test_add_join_to_query(query, tables) -> None:
+    with pytest.warns(SunpyDeprecationWarning, match="add_join_to_query is deprecated"):
+        where_part, from_part, select_part = SOARClient.add_join_to_query(query, "v_sc_data_item", tables)
+    assert SOARClient._construct_payload(query)["QUERY"] == f"SELECT {select_part} FROM {from_part} WHERE {where_part}"
+
+
+def test_column_projection_query() -> None:
+    result = SOARClient._construct_payload(["instrument='MAG'", "level='L2'"], columns=["Instrument", "Filesize"])
+    assert result["QUERY"] == (
+        "SELECT instrument, level, begin_time, data_item_id, filename, filesize FROM v_sc_data_item"
+        " WHERE instrument='MAG' AND level='L2'"
+    )
+
+    result = SOARClient._construct_payload(["instrument='EUI'", "level='L2'"], columns=["Wavelength"])
+    assert result["QUERY"].startswith(
+        "SELECT h1.level, h1.begin_time, h1.data_item_id, h1.filename, h2.wavelength FROM v_sc_data_item AS h1"
+    )
+
+
+def test_column_projection_unknown_column() -> None:
+    with pytest.raises(ValueError, match=r"Unknown columns \['Size'\]"):
+        SOARClient._construct_payload(["instrument='MAG'"], columns=["Instrument", "Size"])
+
+
+@pytest.mark.parametrize(
+    ("query", "columns"),
+    [
+        (["instrument='MAG'"], ["Detector"]),
+        (["instrument='MAG'"], ["Instrument", "Wavelength"]),
+        (["instrument='EUI'"], ["Sensor"]),
+        (["instrument='MAG'", "level='LL02'"], ["Sensor"]),
+    ],
+)
+def test_column_projection_unavailable_column(query, columns) -> None:
+    with pytest.raises(ValueError, match=r"are not available for queries of v_(sc|ll)_data_item"):
+        SOARClient._construct_payload(query, columns=columns)
+
+
+def test_column_projection_sensor() -> None:
+    result = SOARClient._construct_payload(["instrument='MAG'"], columns=["Sensor"])
+    assert result["QUERY"].startswith("SELECT level, begin_time, data_item_id, filename, sensor FROM v_sc_data_item")
+
+
 def test_distance_search_remote_sensing():
     instrument = a.Instrument("RPW")
     product = a.soar.Product("rpw-tnr-surv")
@@ -391,7 +554,8 @@ def test_soar_server_down() -> None:
     # to be raised due to the absence of a valid JSON response.
     tap_endpoint = (
         "http://soar.esac.esa.int/soar-sl-tap/tap/sync?REQUEST=doQuery&LANG=ADQL&FORMAT=json&QUERY=SELECT"
-        " * FROM v_ll_data_item WHERE begin_time%3E='2020-11-13 00:00:00' AND "
+        " instrument, descriptor, level, begin_time, end_time, data_item_id, filesize, filename, soop_name"
+        " FROM v_ll_data_item WHERE begin_time%3E='2020-11-13 00:00:00' AND "
         "begin_time%3C='2020-11-14 00:00:00' AND level='LL02' AND descriptor='mag'"
     )
     # We do not give any json data similar to the condition when the server is down.
@@ -415,7 +579,8 @@ def test_soar_server_down_post71() -> None:
     # to be raised due to the absence of a valid JSON response.
     tap_endpoint = (
         "http://soar.esac.esa.int/soar-sl-tap/tap/sync?REQUEST=doQuery&LANG=ADQL&FORMAT=json&QUERY=SELECT"
-        " * FROM v_ll_data_item WHERE begin_time%3E='2020-11-13 00:00:00' AND "
+        " instrument, descriptor, level, begin_time, end_time, data_item_id, filesize, filename, soop_name"
+        " FROM v_ll_data_item WHERE begin_time%3E='2020-11-13 00:00:00' AND "
         "begin_time%3C='2020-11-14 00:00:00' AND level='LL02' AND descriptor='mag'"
     )
     # We do not give any json data similar to the condition when the server is down.
@@ -429,3 +594,1172 @@ def test_soar_server_down_post71() -> None:
     assert isinstance(query['soar'].errors, RuntimeError)
     assert ("The SOAR server returned an invalid JSON response. It may be down or not functioning correctly."
             == str(query['soar'].errors))
+
+
+TAP_SYNC_URL = "http://soar.esac.esa.int/soar-sl-tap/tap/sync"
+TAP_METADATA = [
+    {"name": "instrument", "datatype": "char", "arraysize": "*"},
+    {"name": "descriptor", "datatype": "char", "arraysize": "*"},
+    {"name": "level", "datatype": "char", "arraysize": "*"},
+    {"name": "begin_time", "datatype": "char", "arraysize": "*", "xtype": "timestamp"},
+    {"name": "end_time", "datatype": "char", "arraysize": "*", "xtype": "timestamp"},
+    {"name": "data_item_id", "datatype": "char", "arraysize": "*"},
+    {"name": "filesize", "datatype": "long"},
+    {"name": "filename", "datatype": "char", "arraysize": "*"},
+    {"name": "soop_name", "datatype": "char", "arraysize": "*"},
+]
+
+
+def _tap_row(instrument, descriptor, begin_time, level="L2"):
+    # A row of the SOAR data item table as returned by the TAP service
+    data_item_id = f"solo_{level}_{descriptor}_{begin_time[:10].replace('-', '')}"
+    return [
+        instrument,
+        descriptor,
+        level,
+        f"{begin_time}.000",
+        f"{begin_time}.000",
+        data_item_id,
+        1000000,
+        f"{data_item_id}_V01.cdf",
+        "none",
+    ]
+
+
+def _tap_json(rows):
+    return {"metadata": TAP_METADATA, "data": rows}
+
+
+def _mock_tap(rows_by_instrument, delays=None):
+    # Respond to each sync query with the rows of the instrument it asks for,
+    # optionally waiting first so that queries complete out of order.
+    delays = delays or {}
+
+    def callback(request):
+        query = request.url.replace("%27", "'")
+        for instrument, rows in rows_by_instrument.items():
+            if f"instrument='{instrument}'" in query:
+                time.sleep(delays.get(instrument, 0))
+                return 200, {}, json.dumps(_tap_json(rows))
+        return 200, {}, json.dumps(_tap_json([]))
+
+    responses.add_callback(responses.GET, re.compile(f"{TAP_SYNC_URL}.*"), callback=callback)
+
+
+@responses.activate
+def test_concurrent_search_keeps_query_order() -> None:
+    _mock_tap(
+        {
+            "MAG": [_tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")],
+            "SWA": [_tap_row("SWA", "swa-pas-grnd-mom", "2020-04-16 00:00:00")],
+            "RPW": [_tap_row("RPW", "rpw-tnr-surv", "2020-04-16 00:00:00")],
+        },
+        # Make the first branch finish last
+        delays={"MAG": 0.2},
+    )
+    query = a.Time("2020-04-16", "2020-04-17") & (a.Instrument("MAG") | a.Instrument("SWA") | a.Instrument("RPW"))
+
+    res = SOARClient(max_workers=3, merge_queries=False).search(query)
+    assert len(responses.calls) == 3
+    assert list(res["Instrument"]) == ["MAG", "SWA", "RPW"]
+
+    serial = SOARClient(max_workers=1, merge_queries=False).search(query)
+    assert list(serial["Instrument"]) == list(res["Instrument"])
+
+
+@responses.activate
+def test_search_drops_duplicates_across_queries() -> None:
+    _mock_tap(
+        {
+            "MAG": [
+                _tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00"),
+                _tap_row("MAG", "mag-rtn-normal", "2020-04-17 00:00:00"),
+            ],
+        }
+    )
+    # Both time ranges find both files
+    query = (a.Time("2020-04-16", "2020-04-18") | a.Time("2020-04-17", "2020-04-19")) & a.Instrument("MAG")
+    res = SOARClient().search(query)
+    assert len(responses.calls) == 2
+    assert list(res["Data item ID"]) == ["solo_L2_mag-rtn-normal_20200416", "solo_L2_mag-rtn-normal_20200417"]
+
+
+def test_invalid_max_workers() -> None:
+    with pytest.raises(ValueError, match="max_workers must be at least 1"):
+        SOARClient(max_workers=0)
+
+
+def test_default_session_retries() -> None:
+    client = SOARClient(retries=5, backoff_factor=1)
+    adapter = client.session.get_adapter(TAP_SYNC_URL)
+    assert adapter.max_retries.total == 5
+    assert adapter.max_retries.backoff_factor == 1
+    assert 503 in adapter.max_retries.status_forcelist
+
+
+@responses.activate(registry=OrderedRegistry)
+def test_search_retries_server_error() -> None:
+    responses.add(responses.GET, re.compile(f"{TAP_SYNC_URL}.*"), status=503)
+    responses.add(
+        responses.GET,
+        re.compile(f"{TAP_SYNC_URL}.*"),
+        json=_tap_json([_tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")]),
+    )
+    client = SOARClient(backoff_factor=0)
+    res = client.search(a.Time("2020-04-16", "2020-04-17"), a.Instrument("MAG"))
+    assert len(responses.calls) == 2
+    assert len(res) == 1
+
+
+@responses.activate
+def test_search_metrics() -> None:
+    response_json = _tap_json([_tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")])
+    responses.add(responses.GET, re.compile(f"{TAP_SYNC_URL}.*"), json=response_json)
+    phases = []
+    metrics = SOARMetrics(callbacks=[lambda phase, duration, attributes: phases.append((phase, attributes))])
+    SOARClient(metrics=metrics).search(a.Time("2020-04-16", "2020-04-17"), a.Instrument("MAG"))
+
+    assert [phase for phase, _ in phases] == [
+        "walk",
+        "request",
+        "decode",
+        "parse_time",
+        "parse_time",
+        "table",
+        "merge",
+        "search",
+    ]
+    assert dict(phases)["search"] == {"sub_queries": 1, "rows": 1}
+    assert dict(phases)["request"] == {"status": 200, "retries": 0}
+    assert metrics.counters == {
+        "queries": 1,
+        "retries": 0,
+        "bytes_received": len(json.dumps(response_json)),
+        "rows_parsed": 1,
+    }
+    assert metrics.durations["search"][0] == 1
+
+    text = metrics.to_prometheus()
+    assert "# TYPE sunpy_soar_phase_seconds summary\n" in text
+    assert 'sunpy_soar_phase_seconds_count{phase="parse_time"} 2\n' in text
+    assert "# TYPE sunpy_soar_rows_parsed_total counter\nsunpy_soar_rows_parsed_total 1\n" in text
+
+    metrics.reset()
+    assert metrics.to_prometheus() == ""
+
+
+def test_default_metrics(monkeypatch, tmp_path) -> None:
+    metrics = SOARMetrics()
+    monkeypatch.setattr(SOARClient, "metrics", metrics)
+    SOARClient().fetch(_fetch_results(), path=tmp_path / "{file}", downloader=_RecordingDownloader())
+    assert metrics.counters == {"files_queued": 3, "files_skipped": 0}
+    assert SOARClient(metrics=SOARMetrics()).metrics is not metrics
+
+
+@responses.activate
+def test_search_uses_given_session() -> None:
+    responses.add(responses.GET, re.compile(f"{TAP_SYNC_URL}.*"), json=_tap_json([]))
+    session = requests.Session()
+    session.headers["User-Agent"] = "sunpy-soar-test"
+    SOARClient(session=session).search(a.Time("2020-04-16", "2020-04-17"), a.Instrument("MAG"))
+    assert responses.calls[0].request.headers["User-Agent"] == "sunpy-soar-test"
+
+
+@responses.activate
+def test_query_cache(tmp_path) -> None:
+    _mock_tap({"MAG": [_tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")]})
+    query = a.Time("2020-04-16", "2020-04-17") & a.Instrument("MAG")
+    client = SOARClient(cache=SOARQueryCache(tmp_path))
+
+    res = client.search(query)
+    assert len(responses.calls) == 1
+    cached = client.search(query)
+    assert len(responses.calls) == 1
+    assert list(cached["Data item ID"]) == list(res["Data item ID"])
+    assert u.allclose(cached["Filesize"], res["Filesize"])
+
+    client.cache.clear()
+    client.search(query)
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_query_cache_expiry(tmp_path) -> None:
+    _mock_tap({"MAG": [_tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")]})
+    query = a.Time("2020-04-16", "2020-04-17") & a.Instrument("MAG")
+    client = SOARClient(cache=SOARQueryCache(tmp_path, expiry=0 * u.s))
+    client.search(query)
+    time.sleep(0.01)
+    client.search(query)
+    assert len(responses.calls) == 2
+
+
+def test_query_cache_eviction(tmp_path) -> None:
+    table = QTable({"Data item ID": ["a" * 400]})
+    cache = SOARQueryCache(tmp_path)
+    cache.set({"QUERY": "first"}, table)
+    # Make room for two entries only
+    entry_size = next(tmp_path.glob("*.ecsv")).stat().st_size
+    cache.max_size = 2.5 * entry_size * u.byte
+    cache.set({"QUERY": "second"}, table)
+    # Reading the first entry makes the second the least recently used
+    assert cache.get({"QUERY": "first"}) is not None
+    cache.set({"QUERY": "third"}, table)
+    assert cache.get({"QUERY": "second"}) is None
+    assert cache.get({"QUERY": "third"}) is not None
+    # Whitespace differences do not change the key
+    assert cache.get({"QUERY": " third "}) is not None
+
+
+@pytest.mark.parametrize("step", ["read", "utime"])
+def test_query_cache_entry_removed(tmp_path, monkeypatch, step) -> None:
+    cache = SOARQueryCache(tmp_path)
+    cache.set({"QUERY": "first"}, QTable({"Data item ID": ["a"]}))
+    # Another process removes the entry after it is found, before it is read or its access time is set
+    (path,) = tmp_path.glob("*.ecsv")
+    if step == "read":
+        read = QTable.read
+
+        def remove_then_read(*args, **kwargs):
+            path.unlink()
+            return read(*args, **kwargs)
+
+        monkeypatch.setattr(QTable, "read", remove_then_read)
+    else:
+        utime = os.utime
+
+        def remove_then_utime(*args, **kwargs):
+            path.unlink()
+            return utime(*args, **kwargs)
+
+        monkeypatch.setattr(os, "utime", remove_then_utime)
+    assert cache.get({"QUERY": "first"}) is None
+
+
+def test_table_from_columns() -> None:
+    rows = [
+        _tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00"),
+        _tap_row("MAG", "mag-rtn-normal", "2020-04-17 00:00:00"),
+    ]
+    rows[0][3] = "2020-04-16T00:00:00.12345"
+    rows[1][-1] = None
+    table = _table_from_columns(TAP_METADATA, list(zip(*rows, strict=True)))
+
+    assert table.colnames == [
+        "Instrument",
+        "Data product",
+        "Level",
+        "Start time",
+        "End time",
+        "Data item ID",
+        "Filename",
+        "Filesize",
+        "SOOP Name",
+    ]
+    assert list(table["Start time"]) == ["2020-04-16 00:00:00.123", "2020-04-17 00:00:00.000"]
+    assert table["Filesize"].dtype.kind == "i"
+    assert list(table["SOOP Name"].mask) == [False, True]
+
+
+def test_iso_times_fallback() -> None:
+    # numpy can not parse leap seconds, so these are parsed by sunpy instead
+    assert list(_iso_times(["2016-12-31T23:59:60.000"])) == ["2016-12-31 23:59:60.000"]
+
+
+def test_iso_times_rounds_to_milliseconds(recwarn) -> None:
+    values = ["2020-01-01T00:00:01.9996", "2020-12-31T23:59:59.99951", "2020-01-01T00:00:01.123456Z"]
+    expected = ["2020-01-01 00:00:02.000", "2021-01-01 00:00:00.000", "2020-01-01 00:00:01.123"]
+    assert list(_iso_times(values)) == expected
+    assert list(parse_time([value.rstrip("Z") for value in values]).iso) == expected
+    assert not recwarn.list
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_tap_json_stream_parser(chunk_size) -> None:
+    rows = [_tap_row("MAG", "mag-rtn-normal", f"2020-04-{day:02d} 00:00:00") for day in range(1, 6)]
+    rows[2][-1] = None
+    body = json.dumps({"metadata": TAP_METADATA, "data": rows, "extra": 1.5}, indent=1).encode()
+
+    parser = _TAPJSONStreamParser(chunk_rows=2)
+    for i in range(0, len(body), chunk_size):
+        parser.feed(body[i : i + chunk_size])
+    metadata, columns = parser.close()
+
+    assert metadata == TAP_METADATA
+    expected = _table_from_columns(TAP_METADATA, list(zip(*rows, strict=True)))
+    streamed = _table_from_columns(metadata, columns)
+    assert streamed.colnames == expected.colnames
+    for name in expected.colnames:
+        assert list(streamed[name]) == list(expected[name])
+    assert list(streamed["SOOP Name"].mask) == [False, False, True, False, False]
+
+
+def test_tap_json_stream_parser_empty() -> None:
+    parser = _TAPJSONStreamParser()
+    parser.feed(json.dumps(_tap_json([])).encode())
+    metadata, columns = parser.close()
+    assert len(_table_from_columns(metadata, columns)) == 0
+
+
+@pytest.mark.parametrize("body", [b"Invalid JSON response", b'{"metadata": [], "data": [[1]', b"{}"])
+def test_tap_json_stream_parser_invalid(body) -> None:
+    parser = _TAPJSONStreamParser()
+    with pytest.raises(json.JSONDecodeError):  # NOQA: PT012
+        parser.feed(body)
+        parser.close()
+
+
+@responses.activate
+def test_stream_search() -> None:
+    _mock_tap({"MAG": [_tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")]})
+    query = a.Time("2020-04-16", "2020-04-17") & a.Instrument("MAG")
+    res = SOARClient(stream=True).search(query)
+    assert list(res["Data item ID"]) == ["solo_L2_mag-rtn-normal_20200416"]
+
+
+@responses.activate
+def test_stream_search_invalid_json() -> None:
+    responses.add(responses.GET, re.compile(f"{TAP_SYNC_URL}.*"), body="Invalid JSON response")
+    with pytest.raises(RuntimeError, match="The SOAR server returned an invalid JSON response"):
+        SOARClient(stream=True).search(a.Time("2020-04-16", "2020-04-17") & a.Instrument("MAG"))
+
+
+def _tap_table(rows):
+    names = [column["name"] for column in TAP_METADATA]
+    return QTable(rows=rows, names=names) if rows else QTable(names=names, dtype=[str] * 6 + [int] + [str] * 2)
+
+
+@responses.activate
+def test_csv_search() -> None:
+    rows = [_tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")]
+    csv = io.StringIO()
+    _tap_table(rows).write(csv, format="ascii.csv")
+    responses.add(responses.GET, re.compile(f"{TAP_SYNC_URL}.*FORMAT=csv.*instrument='MAG'"), body=csv.getvalue())
+    responses.add(
+        responses.GET, re.compile(f"{TAP_SYNC_URL}.*FORMAT=csv.*instrument='SWA'"), body=",".join(_tap_table([]).colnames)
+    )
+
+    query = a.Time("2020-04-16", "2020-04-17") & (a.Instrument("MAG") | a.Instrument("SWA"))
+    res = SOARClient(response_format="csv", merge_queries=False).search(query)
+    assert list(res["Data item ID"]) == ["solo_L2_mag-rtn-normal_20200416"]
+    assert list(res["Start time"]) == ["2020-04-16 00:00:00.000"]
+    assert u.allclose(res["Filesize"], 1 * u.Mbyte)
+
+
+@responses.activate
+def test_csv_search_empty_column() -> None:
+    # The SWA files have no SOOP, so their soop_name column is all empty and its type can not be inferred
+    for instrument, soop_name in (("MAG", "none"), ("SWA", "")):
+        row = _tap_row(instrument, f"{instrument.lower()}-normal", "2020-04-16 00:00:00")
+        row[-1] = soop_name
+        body = "\n".join([",".join(_tap_table([]).colnames), ",".join(map(str, row))])
+        responses.add(responses.GET, re.compile(f"{TAP_SYNC_URL}.*FORMAT=csv.*instrument='{instrument}'"), body=body)
+
+    query = a.Time("2020-04-16", "2020-04-17") & (a.Instrument("MAG") | a.Instrument("SWA"))
+    res = SOARClient(response_format="csv", merge_queries=False).search(query)
+    assert list(res["Instrument"]) == ["MAG", "SWA"]
+    assert res["SOOP Name"].dtype.kind == "U"
+    assert list(res["SOOP Name"].mask) == [False, True]
+    assert u.allclose(res["Filesize"], 1 * u.Mbyte)
+
+
+@responses.activate
+def test_votable_search() -> None:
+    rows = [_tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")]
+    votable = io.BytesIO()
+    from_table(_tap_table(rows)).to_xml(votable, tabledata_format="binary2")
+    responses.add(responses.GET, re.compile(f"{TAP_SYNC_URL}.*FORMAT=votable"), body=votable.getvalue())
+
+    res = SOARClient(response_format="votable").search(a.Time("2020-04-16", "2020-04-17") & a.Instrument("MAG"))
+    assert list(res["Data item ID"]) == ["solo_L2_mag-rtn-normal_20200416"]
+    assert res["Instrument"].dtype.kind == "U"
+
+
+@responses.activate
+def test_csv_search_invalid_response() -> None:
+    responses.add(responses.GET, re.compile(f"{TAP_SYNC_URL}.*"), body="Invalid JSON response")
+    with pytest.raises(RuntimeError, match="The SOAR server returned an invalid CSV response"):
+        SOARClient(response_format="csv").search(a.Time("2020-04-16", "2020-04-17") & a.Instrument("MAG"))
+
+
+def test_invalid_response_format() -> None:
+    with pytest.raises(ValueError, match="response_format must be one of"):
+        SOARClient(response_format="fits")
+
+
+@responses.activate
+def test_time_window_search() -> None:
+    def callback(request):
+        query = unquote(request.url)
+        start = re.search(r"begin_time>='(\S+)", query).group(1)
+        # Each window finds its own item and one item on the window boundary
+        rows = [_tap_row("MAG", "mag-rtn-normal", f"{start} 00:00:00"), _tap_row("MAG", "mag-boundary", "2020-04-02 00:00:00")]
+        return 200, {}, json.dumps(_tap_json(rows))
+
+    responses.add_callback(responses.GET, re.compile(f"{TAP_SYNC_URL}.*"), callback=callback)
+
+    client = SOARClient(time_window=1 * u.day)
+    res = client.search(a.Time("2020-04-01", "2020-04-03 12:00"), a.Instrument("MAG"))
+    assert len(responses.calls) == 3
+    assert list(res["Data item ID"]) == [
+        "solo_L2_mag-rtn-normal_20200401",
+        "solo_L2_mag-boundary_20200402",
+        "solo_L2_mag-rtn-normal_20200402",
+        "solo_L2_mag-rtn-normal_20200403",
+    ]
+
+
+def test_invalid_time_window() -> None:
+    with pytest.raises(ValueError, match="time_window must be positive"):
+        SOARClient(time_window=0 * u.day)
+    with pytest.raises(u.UnitsError):
+        SOARClient(time_window=1 * u.m)
+
+
+TAP_ASYNC_URL = "http://soar.esac.esa.int/soar-sl-tap/tap/async"
+
+
+def _mock_uws(rows, phases):
+    # A minimal UWS job service: submitting creates job 1, which goes through
+    # ``phases`` as it is polled and then returns ``rows``.
+    job_url = f"{TAP_ASYNC_URL}/1"
+    phases = list(phases)
+
+    def phase_callback(request):
+        return 200, {}, phases.pop(0) if len(phases) > 1 else phases[0]
+
+    responses.add(responses.POST, TAP_ASYNC_URL, status=303, headers={"Location": job_url})
+    responses.add_callback(responses.GET, f"{job_url}/phase", callback=phase_callback)
+    responses.add(responses.POST, f"{job_url}/phase", status=303, headers={"Location": job_url})
+    responses.add(responses.GET, f"{job_url}/results/result", json=_tap_json(rows))
+    responses.add(responses.DELETE, job_url, status=303, headers={"Location": TAP_ASYNC_URL})
+    return job_url
+
+
+@responses.activate
+def test_search_with_jobs(monkeypatch) -> None:
+    _mock_uws([_tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")], ["QUEUED", "EXECUTING", "COMPLETED"])
+    monkeypatch.setattr(SOARTapJob, "poll_interval", 0)
+    res = SOARClient(use_jobs=True).search(a.Time("2020-04-16", "2020-04-17"), a.Instrument("MAG"))
+    assert list(res["Data item ID"]) == ["solo_L2_mag-rtn-normal_20200416"]
+
+    submit = responses.calls[0].request
+    assert "PHASE=RUN" in submit.body
+    assert "instrument='MAG'" in unquote(submit.body)
+    # The job is deleted once its results are read
+    assert responses.calls[-1].request.method == "DELETE"
+    assert responses.calls[-1].request.url == f"{TAP_ASYNC_URL}/1"
+
+
+@responses.activate
+def test_resume_job() -> None:
+    job_url = _mock_uws([_tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")], ["EXECUTING", "COMPLETED"])
+    (job,) = SOARClient().submit_jobs(a.Time("2020-04-16", "2020-04-17"), a.Instrument("MAG"))
+    assert job.url == job_url
+
+    # A job can be picked up again from its URL alone
+    resumed = SOARTapJob(job.url)
+    assert resumed.phase == "EXECUTING"
+    table = resumed.result(poll_interval=0)
+    assert list(table["Data item ID"]) == ["solo_L2_mag-rtn-normal_20200416"]
+    # Jobs submitted by the user are only deleted when asked to
+    assert all(call.request.method != "DELETE" for call in responses.calls)
+    resumed.delete()
+    assert responses.calls[-1].request.method == "DELETE"
+
+
+@responses.activate
+def test_cancel_job() -> None:
+    job_url = _mock_uws([], ["EXECUTING", "ABORTED"])
+    job = SOARTapJob(job_url)
+    job.cancel()
+    assert responses.calls[0].request.body == "PHASE=ABORT"
+    with pytest.raises(RuntimeError, match="finished with phase ABORTED"):
+        job.wait(poll_interval=0)
+
+
+@responses.activate
+def test_job_timeout() -> None:
+    job_url = _mock_uws([], ["EXECUTING"])
+    with pytest.raises(TimeoutError):
+        SOARTapJob(job_url).wait(timeout=0.1, poll_interval=0.05)
+
+
+def _mock_paged_tap(rows, max_calls=50):
+    # Respond to paged sync queries with the matching page of ``rows``, and fail a pager which does not move on
+    calls = []
+
+    def callback(request):
+        calls.append(request)
+        if len(calls) > max_calls:
+            return 400, {}, "Too many pages"
+        query = unquote(request.url)
+        selected = sorted(rows, key=lambda row: (row[3], row[5]))
+        start, end = re.search(r"begin_time>='([^']*)' AND begin_time<='([^']*)'", query).groups()
+        selected = [row for row in selected if start <= row[3][:19] <= end]
+        after = re.search(r"begin_time>'([^']*)' OR \(begin_time='[^']*' AND data_item_id>'([^']*)'\)", query)
+        if after:
+            selected = [row for row in selected if (row[3], row[5]) > after.groups()]
+        page_size = int(re.search(r"SELECT TOP (\d+) ", query).group(1))
+        return 200, {}, json.dumps(_tap_json(selected[:page_size]))
+
+    responses.add_callback(responses.GET, re.compile(f"{TAP_SYNC_URL}.*"), callback=callback)
+
+
+@responses.activate
+def test_iter_search() -> None:
+    rows = [_tap_row("MAG", f"mag-rtn-normal-{i}", f"2020-04-16 0{i // 2}:00:00") for i in range(7)]
+    _mock_paged_tap(rows)
+    pages = list(SOARClient().iter_search(a.Time("2020-04-16", "2020-04-17"), a.Instrument("MAG"), page_size=3))
+    # Each page starts from the last start time of the previous one, whose data items are not returned again
+    assert [len(page) for page in pages] == [3, 2, 2]
+    assert [data_item_id for page in pages for data_item_id in page["Data item ID"]] == [row[5] for row in rows]
+    assert all(page["Filesize"].unit == u.Mbyte for page in pages)
+
+    first, second = (unquote(call.request.url) for call in responses.calls[:2])
+    assert "ORDER BY begin_time, data_item_id" in first
+    assert "begin_time>'2020-04-16 00:59:59.9995' OR (begin_time='2020-04-16 00:59:59.9995'" in second
+    assert "data_item_id>'solo_L2_mag-rtn-normal-2_20200416')" in second
+
+
+@responses.activate
+def test_iter_search_time_window() -> None:
+    # The row at midnight is found by the queries for both days
+    rows = [_tap_row("MAG", "mag-rtn-normal", day) for day in ("2020-04-16 12:00:00", "2020-04-17 00:00:00")]
+    _mock_paged_tap(rows)
+    pages = SOARClient(time_window=1 * u.day).iter_search(
+        a.Time("2020-04-16", "2020-04-18"), a.Instrument("MAG"), page_size=5
+    )
+    assert [data_item_id for page in pages for data_item_id in page["Data item ID"]] == [
+        "solo_L2_mag-rtn-normal_20200416",
+        "solo_L2_mag-rtn-normal_20200417",
+    ]
+
+
+@responses.activate
+def test_iter_search_rounded_start_time() -> None:
+    # The last two files both start at 00:00:01.000 once rounded to milliseconds
+    rows = [_tap_row("MAG", f"mag-rtn-normal-{i}", "2020-04-16 00:00:00") for i in range(3)]
+    for row, begin_time in zip(rows, ("00:00:00.9994", "00:00:00.9996", "00:00:00.9997"), strict=True):
+        row[3] = f"2020-04-16 {begin_time}"
+    _mock_paged_tap(rows)
+    pages = list(SOARClient().iter_search(a.Time("2020-04-16", "2020-04-17"), a.Instrument("MAG"), page_size=2))
+    assert [data_item_id for page in pages for data_item_id in page["Data item ID"]] == [row[5] for row in rows]
+
+
+@responses.activate
+def test_iter_search_shared_start_time(tmp_path) -> None:
+    # More files than fit in a page start at midnight, as many daily products do
+    rows = [_tap_row("MAG", f"mag-rtn-normal-{i}", "2020-04-16 00:00:00") for i in range(5)]
+    rows.append(_tap_row("MAG", "mag-rtn-burst", "2020-04-16 12:00:00"))
+    _mock_paged_tap(rows)
+    query = (a.Time("2020-04-16", "2020-04-17"), a.Instrument("MAG"))
+    pages = list(SOARClient().iter_search(*query, page_size=2))
+    assert sorted(data_item_id for page in pages for data_item_id in page["Data item ID"]) == sorted(
+        row[5] for row in rows
+    )
+    assert len(responses.calls) < 10
+    assert SOARMirror(tmp_path / "mirror.sqlite").sync(*query, page_size=2) == 6
+
+
+def test_iter_search_invalid_page_size() -> None:
+    with pytest.raises(ValueError, match="page_size must be at least 1"):
+        next(SOARClient().iter_search(a.Instrument("MAG"), page_size=0))
+
+
+def test_paged_distance_query() -> None:
+    result = SOARClient._construct_payload(
+        ["instrument='EUI'", "DISTANCE(0.28,0.30)", "level='L2'"],
+        page_size=100,
+        after=("2021-02-01 00:00:00.000", "solo_L2_eui"),
+    )
+    assert result["QUERY"].startswith("SELECT TOP 100 h1.instrument, ")
+    assert result["QUERY"].endswith(
+        " WHERE h1.instrument='EUI' AND h1.level='L2' AND (h1.begin_time>'2021-02-01 00:00:00.000' OR "
+        "(h1.begin_time='2021-02-01 00:00:00.000' AND h1.data_item_id>'solo_L2_eui'))"
+        " ORDER BY h1.begin_time, h1.data_item_id&DISTANCE(0.28,0.30)"
+    )
+
+
+class _LocalResolver(aiohttp.abc.AbstractResolver):
+    # Resolve every host to a local test server
+    def __init__(self, port) -> None:
+        self.port = port
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        return [
+            {"hostname": host, "host": "127.0.0.1", "port": self.port, "family": family, "proto": 0, "flags": 0}
+        ]
+
+    async def close(self) -> None:
+        pass
+
+
+@contextlib.asynccontextmanager
+async def _local_soar(routes):
+    # Serve ``routes`` locally and yield a resolver which sends all requests to them
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    try:
+        yield _LocalResolver(runner.addresses[0][1])
+    finally:
+        await runner.cleanup()
+
+
+def _tap_handler(rows_by_instrument, response_format="json", delays=None):
+    delays = delays or {}
+    requests_seen = []
+
+    async def handler(request):
+        requests_seen.append(request)
+        rows = []
+        for instrument, instrument_rows in rows_by_instrument.items():
+            if f"instrument='{instrument}'" in request.query["QUERY"]:
+                await asyncio.sleep(delays.get(instrument, 0))
+                rows = instrument_rows
+        if response_format == "csv":
+            csv = io.StringIO()
+            _tap_table(rows).write(csv, format="ascii.csv")
+            return web.Response(text=csv.getvalue())
+        return web.json_response(_tap_json(rows))
+
+    handler.requests = requests_seen
+    return handler
+
+
+@pytest.mark.parametrize(("response_format", "stream"), [("json", False), ("json", True), ("csv", False)])
+def test_search_async(response_format, stream) -> None:
+    handler = _tap_handler(
+        {
+            "MAG": [_tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")],
+            "SWA": [_tap_row("SWA", "swa-pas-grnd-mom", "2020-04-16 00:00:00")],
+            "RPW": [_tap_row("RPW", "rpw-tnr-surv", "2020-04-16 00:00:00")],
+        },
+        response_format=response_format,
+        # Make the first branch finish last
+        delays={"MAG": 0.2},
+    )
+    query = a.Time("2020-04-16", "2020-04-17") & (a.Instrument("MAG") | a.Instrument("SWA") | a.Instrument("RPW"))
+    client = SOARClient(max_workers=3, response_format=response_format, stream=stream, merge_queries=False)
+
+    async def search():
+        async with (
+            _local_soar([web.get("/soar-sl-tap/tap/sync", handler)]) as resolver,
+            aiohttp.ClientSession(connector=aiohttp.TCPConnector(resolver=resolver)) as session,
+        ):
+            return await client.search_async(query, session=session)
+
+    res = asyncio.run(search())
+    assert len(handler.requests) == 3
+    assert handler.requests[0].query["FORMAT"] == response_format
+    assert list(res["Instrument"]) == ["MAG", "SWA", "RPW"]
+    assert res["Filesize"].unit == u.Mbyte
+
+
+def test_search_async_retries_server_error() -> None:
+    statuses = [503, 200]
+
+    async def handler(request):
+        status = statuses.pop(0)
+        if status != 200:
+            return web.Response(status=status)
+        return web.json_response(_tap_json([_tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")]))
+
+    async def search():
+        async with (
+            _local_soar([web.get("/soar-sl-tap/tap/sync", handler)]) as resolver,
+            aiohttp.ClientSession(connector=aiohttp.TCPConnector(resolver=resolver)) as session,
+        ):
+            return await SOARClient(backoff_factor=0, metrics=metrics).search_async(
+                a.Time("2020-04-16", "2020-04-17"), a.Instrument("MAG"), session=session
+            )
+
+    metrics = SOARMetrics()
+    res = asyncio.run(search())
+    assert statuses == []
+    assert len(res) == 1
+    assert metrics.counters["queries"] == 1
+    assert metrics.counters["retries"] == 1
+
+
+def test_search_async_invalid_response() -> None:
+    async def handler(request):
+        return web.Response(text="<html>Service unavailable</html>")
+
+    async def search():
+        async with (
+            _local_soar([web.get("/soar-sl-tap/tap/sync", handler)]) as resolver,
+            aiohttp.ClientSession(connector=aiohttp.TCPConnector(resolver=resolver)) as session,
+        ):
+            return await SOARClient().search_async(
+                a.Time("2020-04-16", "2020-04-17"), a.Instrument("MAG"), session=session
+            )
+
+    with pytest.raises(RuntimeError, match="invalid JSON response"):
+        asyncio.run(search())
+
+
+def test_fetch_async(tmp_path) -> None:
+    search_handler = _tap_handler({"MAG": [_tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")]})
+
+    async def data_handler(request):
+        return web.Response(body=request.query["data_item_id"].encode())
+
+    async def search_and_fetch():
+        async with _local_soar(
+            [web.get("/soar-sl-tap/tap/sync", search_handler), web.get("/soar-sl-tap/data", data_handler)]
+        ) as resolver:
+            client = SOARClient()
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(resolver=resolver)) as session:
+                res = await client.search_async(
+                    a.Time("2020-04-16", "2020-04-17"), a.Instrument("MAG"), session=session
+                )
+            config = parfive.SessionConfig(
+                aiohttp_session_generator=lambda config: aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(resolver=resolver), headers=config.headers
+                )
+            )
+            downloader = parfive.Downloader(progress=False, config=config)
+            return await client.fetch_async(res, path=tmp_path, downloader=downloader)
+
+    files = asyncio.run(search_and_fetch())
+    assert not files.errors
+    assert [Path(file).name for file in files] == ["solo_L2_mag-rtn-normal_20200416_V01.cdf"]
+    assert Path(files[0]).read_text() == "solo_L2_mag-rtn-normal_20200416"
+
+
+@responses.activate
+def test_search_columns() -> None:
+    metadata = [column for column in TAP_METADATA if column["name"] in ("level", "begin_time", "data_item_id", "filename")]
+    row = _tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00")
+    responses.add(
+        responses.GET,
+        re.compile(f"{TAP_SYNC_URL}.*"),
+        json={"metadata": metadata, "data": [[row[2], row[3], row[5], row[7]]]},
+    )
+    res = SOARClient().search(a.Time("2020-04-16", "2020-04-17"), a.Instrument("MAG"), columns=["Level"])
+    assert "SELECT level, begin_time, data_item_id, filename FROM" in unquote(responses.calls[0].request.url)
+    assert res.colnames == ["Level", "Start time", "Data item ID", "Filename"]
+    assert res["Start time"][0] == "2020-04-16 00:00:00.000"
+
+
+def _summary_json(rows):
+    metadata = [
+        {"name": "instrument", "datatype": "char", "arraysize": "*"},
+        {"name": "level", "datatype": "char", "arraysize": "*"},
+        {"name": "n_files", "datatype": "long"},
+        {"name": "total_size", "datatype": "long"},
+    ]
+    return {"metadata": metadata, "data": rows}
+
+
+@responses.activate
+def test_summary() -> None:
+    responses.add(
+        responses.GET,
+        re.compile(f"{TAP_SYNC_URL}.*instrument='MAG'"),
+        json=_summary_json([["MAG", "L2", 10, 2000000], ["MAG", "L1", 2, 500000]]),
+    )
+    responses.add(
+        responses.GET, re.compile(f"{TAP_SYNC_URL}.*instrument='SWA'"), json=_summary_json([["SWA", "L2", 3, 1000000]])
+    )
+    summary = SOARClient(merge_queries=False).summary(
+        a.Time("2020-04-16", "2021-04-17"), a.Instrument("MAG") | a.Instrument("SWA")
+    )
+    query = unquote(responses.calls[0].request.url)
+    assert "SELECT instrument, level, COUNT(*) AS n_files, SUM(filesize) AS total_size FROM" in query
+    assert query.endswith(" GROUP BY instrument, level")
+    assert list(summary["Instrument"]) == ["MAG", "MAG", "SWA"]
+    assert list(summary["Level"]) == ["L1", "L2", "L2"]
+    assert list(summary["Number of files"]) == [2, 10, 3]
+    assert u.allclose(summary["Total size"], [0.5, 2, 1] * u.Mbyte)
+
+
+@responses.activate
+def test_summary_total() -> None:
+    metadata = [{"name": "n_files", "datatype": "long"}, {"name": "total_size", "datatype": "long"}]
+    responses.add(
+        responses.GET, re.compile(f"{TAP_SYNC_URL}.*instrument='MAG'"), json={"metadata": metadata, "data": [[4, 8000]]}
+    )
+    # There are no SWA files, so their total size is null
+    responses.add(
+        responses.GET, re.compile(f"{TAP_SYNC_URL}.*instrument='SWA'"), json={"metadata": metadata, "data": [[0, None]]}
+    )
+    summary = SOARClient(merge_queries=False).summary(
+        a.Time("2020-04-16", "2021-04-17"), a.Instrument("MAG") | a.Instrument("SWA"), by=[]
+    )
+    assert "COUNT(*) AS n_files" in unquote(responses.calls[0].request.url)
+    assert "GROUP BY" not in unquote(responses.calls[0].request.url)
+    assert summary.colnames == ["Number of files", "Total size"]
+    assert summary["Number of files"][0] == 4
+    assert summary["Total size"][0] == 0.008 * u.Mbyte
+
+
+def test_summary_unknown_column() -> None:
+    with pytest.raises(ValueError, match=r"Unknown columns \['Day'\]"):
+        SOARClient().summary(a.Time("2020-04-16", "2021-04-17"), a.Instrument("MAG"), by=["Day"])
+
+
+@pytest.mark.parametrize("column", ["Detector", "Wavelength"])
+def test_summary_unavailable_column(column) -> None:
+    with pytest.raises(ValueError, match=rf"Columns \['{column}'\] are not available for queries of v_sc_data_item"):
+        SOARClient().summary(a.Time("2020-04-16", "2021-04-17"), a.Instrument("MAG"), by=[column])
+
+
+def _mock_counting_tap(rows, in_flight=None):
+    # Respond to count queries with the number of ``rows`` in the time range, and to other queries with the rows.
+    # If ``in_flight`` is given, the number of queries being answered is added to it as each query arrives.
+    answering = []
+
+    def callback(request):
+        if in_flight is not None:
+            answering.append(request)
+            in_flight.append(len(answering))
+            time.sleep(0.02)
+            answering.remove(request)
+        query = unquote(request.url)
+        start, end = re.search(r"begin_time>='([^']*)' AND begin_time<='([^']*)'", query).groups()
+        selected = [row for row in rows if start <= row[3][:19] <= end]
+        if "COUNT(*)" in query:
+            metadata = [{"name": "n_files", "datatype": "long"}, {"name": "total_size", "datatype": "long"}]
+            return 200, {}, json.dumps({"metadata": metadata, "data": [[len(selected), 1000000 * len(selected)]]})
+        return 200, {}, json.dumps(_tap_json(selected))
+
+    responses.add_callback(responses.GET, re.compile(f"{TAP_SYNC_URL}.*"), callback=callback)
+
+
+MAX_ROWS_QUERY = (a.Time("2020-04-16", "2020-04-20"), a.Instrument("MAG"))
+
+
+def _max_rows_rows():
+    return [_tap_row("MAG", f"mag-rtn-normal-{i}", f"2020-04-{16 + i // 2} 0{i % 2}:00:00") for i in range(8)]
+
+
+@responses.activate
+def test_max_rows_not_exceeded() -> None:
+    _mock_counting_tap(_max_rows_rows())
+    res = SOARClient(max_rows=8, on_max_rows="raise").search(*MAX_ROWS_QUERY)
+    assert len(res) == 8
+    assert "COUNT(*)" in unquote(responses.calls[0].request.url)
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_max_rows_raise() -> None:
+    _mock_counting_tap(_max_rows_rows())
+    with pytest.raises(RuntimeError, match="matches 8 files, which is more than max_rows=5"):
+        SOARClient(max_rows=5, on_max_rows="raise").search(*MAX_ROWS_QUERY)
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_max_rows_warn() -> None:
+    _mock_counting_tap(_max_rows_rows())
+    with pytest.warns(SunpyUserWarning, match="matches 8 files"):
+        res = SOARClient(max_rows=5).search(*MAX_ROWS_QUERY)
+    assert len(res) == 8
+
+
+@responses.activate
+def test_max_rows_split() -> None:
+    _mock_counting_tap(_max_rows_rows())
+    res = SOARClient(max_rows=3, on_max_rows="split").search(*MAX_ROWS_QUERY)
+    assert list(res["Data item ID"]) == [row[5] for row in _max_rows_rows()]
+    # The first of the three windows matches four files, so it is split again
+    queries = [unquote(call.request.url) for call in responses.calls if "COUNT(*)" not in unquote(call.request.url)]
+    assert len(queries) == 4
+    for window in (
+        "begin_time>='2020-04-16 00:00:00' AND begin_time<='2020-04-16 16:00:00'",
+        "begin_time>='2020-04-16 16:00:00' AND begin_time<='2020-04-17 08:00:00'",
+        "begin_time>='2020-04-17 08:00:00' AND begin_time<='2020-04-18 16:00:00'",
+        "begin_time>='2020-04-18 16:00:00' AND begin_time<='2020-04-20 00:00:00'",
+    ):
+        assert any(window in query for query in queries)
+
+
+@responses.activate
+def test_max_rows_split_max_workers() -> None:
+    # The windows of both branches share the limit on the queries sent at the same time
+    in_flight = []
+    _mock_counting_tap(_max_rows_rows(), in_flight)
+    client = SOARClient(max_rows=3, on_max_rows="split", max_workers=2, merge_queries=False)
+    res = client.search(MAX_ROWS_QUERY[0], a.Instrument("MAG") | a.Instrument("SWA"))
+    assert len(res) == 8
+    assert max(in_flight) == 2
+
+
+@responses.activate
+def test_max_rows_split_too_short() -> None:
+    # All the files start in the same second, so the time range can not be split
+    rows = [_tap_row("MAG", f"mag-rtn-normal-{i}", "2020-04-16 00:00:00") for i in range(4)]
+    _mock_counting_tap(rows)
+    with pytest.warns(SunpyUserWarning, match="can not be split as its time range is too short"):
+        res = SOARClient(max_rows=3, on_max_rows="split").search(*MAX_ROWS_QUERY)
+    assert len(res) == 4
+
+
+def test_search_async_max_rows() -> None:
+    rows = _max_rows_rows()
+    queries = []
+    in_flight = []
+    most_in_flight = []
+
+    async def handler(request):
+        # Answer count queries with the number of rows in the time range, like _mock_counting_tap
+        query = request.query["QUERY"]
+        queries.append(query)
+        in_flight.append(query)
+        most_in_flight.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(query)
+        start, end = re.search(r"begin_time>='([^']*)' AND begin_time<='([^']*)'", query).groups()
+        selected = [row for row in rows if start <= row[3][:19] <= end]
+        if "COUNT(*)" in query:
+            metadata = [{"name": "n_files", "datatype": "long"}, {"name": "total_size", "datatype": "long"}]
+            return web.json_response({"metadata": metadata, "data": [[len(selected), 1000000 * len(selected)]]})
+        return web.json_response(_tap_json(selected))
+
+    async def search(client, *query):
+        async with (
+            _local_soar([web.get("/soar-sl-tap/tap/sync", handler)]) as resolver,
+            aiohttp.ClientSession(connector=aiohttp.TCPConnector(resolver=resolver)) as session,
+        ):
+            return await client.search_async(*query, session=session)
+
+    with pytest.raises(RuntimeError, match="matches 8 files, which is more than max_rows=5"):
+        asyncio.run(search(SOARClient(max_rows=5, on_max_rows="raise"), *MAX_ROWS_QUERY))
+    assert len(queries) == 1
+
+    res = asyncio.run(search(SOARClient(max_rows=3, on_max_rows="split"), *MAX_ROWS_QUERY))
+    assert list(res["Data item ID"]) == [row[5] for row in rows]
+    assert len([query for query in queries if "COUNT(*)" not in query]) == 4
+
+    # The windows of both branches share the limit on the queries sent at the same time
+    most_in_flight.clear()
+    client = SOARClient(max_rows=3, on_max_rows="split", max_workers=2, merge_queries=False)
+    res = asyncio.run(search(client, MAX_ROWS_QUERY[0], a.Instrument("MAG") | a.Instrument("SWA")))
+    assert len(res) == 8
+    assert max(most_in_flight) == 2
+
+
+@responses.activate
+def test_max_rows_jobs() -> None:
+    _mock_counting_tap(_max_rows_rows())
+    _mock_uws(_max_rows_rows(), ["COMPLETED"])
+    res = SOARClient(max_rows=5, on_max_rows="jobs").search(*MAX_ROWS_QUERY)
+    assert len(res) == 8
+    assert responses.calls[1].request.url == TAP_ASYNC_URL
+    assert responses.calls[-1].request.method == "DELETE"
+
+
+def test_invalid_max_rows() -> None:
+    with pytest.raises(ValueError, match="max_rows must be at least 1"):
+        SOARClient(max_rows=0)
+    with pytest.raises(ValueError, match="on_max_rows must be one of"):
+        SOARClient(max_rows=10, on_max_rows="ignore")
+
+
+@responses.activate
+def test_search_incremental(tmp_path) -> None:
+    rows = _max_rows_rows()
+    _mock_counting_tap(rows)
+    state = SOARSyncState(tmp_path / "state.json", overlap=1 * u.day)
+    client = SOARClient(cache=SOARQueryCache(tmp_path / "cache"))
+
+    res = client.search_incremental(*MAX_ROWS_QUERY, state=state)
+    assert len(res) == 8
+    assert "begin_time>='2020-04-16 00:00:00'" in unquote(responses.calls[-1].request.url)
+
+    # Nothing new, and only files starting after the high-water mark minus the overlap are requested
+    res = client.search_incremental(*MAX_ROWS_QUERY, state=state)
+    assert len(res) == 0
+    assert "begin_time>='2020-04-18 01:00:00'" in unquote(responses.calls[-1].request.url)
+
+    # A file added late within the overlap, and a newer file
+    rows += [
+        _tap_row("MAG", "mag-rtn-burst", "2020-04-19 00:30:00"),
+        _tap_row("MAG", "mag-rtn-normal-8", "2020-04-19 12:00:00"),
+    ]
+    res = client.search_incremental(*MAX_ROWS_QUERY, state=state)
+    assert list(res["Data item ID"]) == ["solo_L2_mag-rtn-burst_20200419", "solo_L2_mag-rtn-normal-8_20200419"]
+
+    # The progress is shared by searches over other time ranges
+    res = client.search_incremental(a.Time("2020-04-01", "2020-04-30"), a.Instrument("MAG"), state=state)
+    assert len(res) == 0
+    assert "begin_time>='2020-04-18 12:00:00'" in unquote(responses.calls[-1].request.url)
+
+    state.clear()
+    res = client.search_incremental(*MAX_ROWS_QUERY, state=state)
+    assert len(res) == 10
+
+
+def test_search_incremental_needs_time(tmp_path) -> None:
+    with pytest.raises(ValueError, match="must include a time range"):
+        SOARClient().search_incremental(a.Instrument("MAG"), state=SOARSyncState(tmp_path / "state.json"))
+
+
+@responses.activate
+def test_mirror(tmp_path) -> None:
+    rows = _max_rows_rows()
+    _mock_paged_tap(rows)
+    mirror = SOARMirror(tmp_path / "mirror.sqlite")
+    assert mirror.sync(*MAX_ROWS_QUERY, page_size=3) == 8
+    # Syncing again updates the copied files
+    assert mirror.sync(*MAX_ROWS_QUERY) == 8
+    n_calls = len(responses.calls)
+
+    client = SOARClient(mirror=mirror)
+    res = client.search(a.Time("2020-04-17", "2020-04-18 00:30"), a.Instrument("MAG"))
+    assert list(res["Data item ID"]) == [row[5] for row in rows[2:5]]
+    # Columns without values for MAG, such as the sensor, are not returned
+    assert res.colnames == [
+        "Instrument",
+        "Data product",
+        "Level",
+        "Start time",
+        "End time",
+        "Data item ID",
+        "Filename",
+        "Filesize",
+        "SOOP Name",
+    ]
+    assert res["Filesize"][0] == 1 * u.Mbyte
+    # Files starting at either end of the time range are found
+    res = client.search(a.Time("2020-04-17", "2020-04-18"), a.Instrument("MAG"))
+    assert list(res["Data item ID"]) == [row[5] for row in rows[2:5]]
+    assert len(client.search(a.Time("2020-04-17", "2020-04-18"), a.Instrument("SWA"))) == 0
+
+    res = client.search(*MAX_ROWS_QUERY, columns=["Instrument"])
+    assert res.colnames == ["Instrument", "Level", "Start time", "Data item ID", "Filename"]
+    pages = list(client.iter_search(*MAX_ROWS_QUERY, page_size=5))
+    assert [len(page) for page in pages] == [5, 3]
+    summary = client.summary(*MAX_ROWS_QUERY)
+    assert list(summary["Number of files"]) == [8]
+    assert summary["Total size"][0] == 8 * u.Mbyte
+
+    # The SOAR is not contacted
+    assert len(responses.calls) == n_calls
+
+    with pytest.raises(ValueError, match="Searches by distance can not be answered"):
+        client.search(a.Instrument("MAG"), a.soar.Distance(0.3 * u.AU, 0.4 * u.AU))
+    assert len(client.search(a.Time("2020-04-17", "2020-04-18"), a.Instrument("EUI"), a.Wavelength(174 * u.AA))) == 0
+    # The SOAR matches the wavelength range of the instrument tables, which is not copied
+    with pytest.raises(ValueError, match="Searches by wavelength range can not be answered"):
+        client.search(a.Instrument("EUI"), a.Wavelength(170 * u.AA, 180 * u.AA))
+
+
+class _RecordingDownloader:
+    # Records the files queued by fetch instead of downloading them
+    def __init__(self) -> None:
+        self.queued = []
+
+    def enqueue_file(self, url, **kwargs) -> None:
+        self.queued.append((url, kwargs))
+
+
+def _fetch_results():
+    table = _table_from_columns(
+        TAP_METADATA,
+        list(
+            zip(
+                *[
+                    _tap_row("MAG", "mag-rtn-normal", "2020-04-16 00:00:00"),
+                    _tap_row("EUI", "eui-fsi174-image", "2020-04-17 00:00:00", level="L1"),
+                    _tap_row("MAG", "mag-rtn-normal", "2020-04-18 00:00:00", level="LL02"),
+                ],
+                strict=True,
+            )
+        ),
+    )
+    table["Filesize"] = [2000000, 400000000, 30000000]
+    return SOARClient()._response_table(table)
+
+
+def test_fetch_queue_order_and_splits(tmp_path) -> None:
+    downloader = _RecordingDownloader()
+    SOARClient().fetch(_fetch_results(), path=tmp_path / "{file}", downloader=downloader)
+    urls = [url for url, _ in downloader.queued]
+    assert [url.rsplit("=", 1)[1] for url in urls] == [
+        "solo_L1_eui-fsi174-image_20200417",
+        "solo_LL02_mag-rtn-normal_20200418",
+        "solo_L2_mag-rtn-normal_20200416",
+    ]
+    assert "product_type=LOW_LATENCY" in urls[1]
+    # Only the file larger than split_size is downloaded in parts
+    assert [kwargs["max_splits"] for _, kwargs in downloader.queued] == [5, 1, 1]
+    assert downloader.queued[0][1]["filename"] == str(tmp_path / "solo_L1_eui-fsi174-image_20200417_V01.cdf")
+
+    downloader = _RecordingDownloader()
+    SOARClient().fetch(
+        _fetch_results(),
+        path=tmp_path / "{file}",
+        downloader=downloader,
+        largest_first=False,
+        split_size=10 * u.Mbyte,
+        max_splits=3,
+    )
+    assert [kwargs["max_splits"] for _, kwargs in downloader.queued] == [1, 3, 3]
+
+
+def test_fetch_skips_duplicates(tmp_path) -> None:
+    downloader = _RecordingDownloader()
+    SOARClient().fetch(_fetch_results()[[0, 1, 2, 1, 0]], path=tmp_path / "{file}", downloader=downloader)
+    assert len(downloader.queued) == 3
+
+
+def test_fetch_skips_complete_files(tmp_path) -> None:
+    # The EUI file is complete, the low latency MAG file is only partly downloaded
+    with (tmp_path / "solo_L1_eui-fsi174-image_20200417_V01.cdf").open("wb") as f:
+        f.truncate(400000123)
+    (tmp_path / "solo_LL02_mag-rtn-normal_20200418_V01.cdf").write_bytes(b"0" * 1000)
+
+    downloader = _RecordingDownloader()
+    existing = SOARClient().fetch(_fetch_results(), path=tmp_path / "{file}", downloader=downloader)
+    assert list(existing) == [str(tmp_path / "solo_L1_eui-fsi174-image_20200417_V01.cdf")]
+    assert [url.rsplit("=", 1)[1] for url, _ in downloader.queued] == [
+        "solo_LL02_mag-rtn-normal_20200418",
+        "solo_L2_mag-rtn-normal_20200416",
+    ]
+    assert [kwargs["overwrite"] for _, kwargs in downloader.queued] == [True, None]
+    # parfive versions without checksums do not accept the argument
+    assert all("checksum" not in kwargs for _, kwargs in downloader.queued)
+
+    # With checksums the complete file is queued so that parfive can verify it
+    downloader = _RecordingDownloader()
+    existing = SOARClient().fetch(_fetch_results(), path=tmp_path / "{file}", downloader=downloader, checksum=True)
+    assert len(existing) == 0
+    assert [kwargs["overwrite"] for _, kwargs in downloader.queued] == [None, True, None]
+    assert [kwargs["checksum"] for _, kwargs in downloader.queued] == [True, True, True]
+
+    # Existing files are not checked if the downloader overwrites them
+    downloader = parfive.Downloader(overwrite=True)
+    SOARClient().fetch(_fetch_results(), path=tmp_path / "{file}", downloader=downloader)
+    assert downloader.queued_downloads == 3
+
+
+def test_import_only_loads_sunpy_net() -> None:
+    # Fido needs sunpy.net to register the client, importing sunpy_soar should not import anything else.
+    # The modules imported by the version module depend on how sunpy_soar was installed, so they are ignored.
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import sunpy.net.base_client; import sunpy_soar"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    lines = result.stderr.splitlines()
+    start = next(i for i, line in enumerate(lines) if line.endswith("| sunpy.net.base_client"))
+    imported = []
+    for line in lines[start + 1 :]:
+        _, cumulative, name = line.split("|")
+        indent = len(name) - len(name.lstrip())
+        if name.strip() == "sunpy_soar.version":
+            while imported and imported[-1][0] > indent:
+                imported.pop()
+        imported.append((indent, name.strip(), int(cumulative)))
+    unexpected = [name for _, name, _ in imported if name.split(".")[0] != "sunpy_soar"]
+    total = imported[-1][2] / 1e6
+    assert not unexpected, f"Importing sunpy_soar took {total:.3f}s and imported {unexpected}"
+    assert "sunpy_soar.mirror" not in [name for _, name, _ in imported]